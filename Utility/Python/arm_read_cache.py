@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""
+Read-through cache for Azure Resource Manager GET requests, shared by the runbooks on a machine.
+
+Mount it on a requests session and GETs of slowly changing resources, such as resource groups,
+storage accounts, the package list of an Automation account and runbook content, are answered
+from the cache while they are younger than the time to live of their resource type. Older entries
+are revalidated with If-None-Match / If-Modified-Since where ARM sent an ETag or Last-Modified,
+so an unchanged resource costs a 304 instead of the full body. Any PUT, POST, PATCH or DELETE sent
+through a session with the cache mounted drops the cached copies of that resource and of its parent
+listing. Requests with Cache-Control: no-cache are always revalidated.
+
+Entries are kept in memory and in a directory only the current user can read, so jobs scheduled
+on the same Hybrid Worker share them, unless the cache is created with cache_dir=None. Each entry belongs to the identity whose token read it, the
+tenant and object id of the bearer token, so jobs running as another identity never see it.
+The least recently used entries are removed past the cap.
+
+    import requests
+    import arm_read_cache
+
+    session = requests.Session()
+    cache = arm_read_cache.mount(session)
+    ...
+    print cache.summary()
+
+Publish this file as a runbook and load it with import_child_runbook.ChildRunbookImporter, or
+copy it next to the runbooks on a Hybrid Worker. Runbooks that import it work without it as well.
+
+Changelog:
+    2026-10-19 AutomationTeam:
+    -initial script
+
+"""
+import base64
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+
+import requests
+import requests.adapters
+import requests.structures
+
+ARM_ENDPOINT = "https://management.azure.com/"
+# Directory only this user can read, holding one folder of entries per resource path.
+# A cache created with cache_dir=None keeps its entries in memory only
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "arm_read_cache")
+MAX_ENTRIES = 1000
+# Seconds a GET is served from the cache, by the first pattern matching its lower-cased path.
+# 0 caches the response but revalidates it on every request. Paths that match nothing are not cached
+TTL_SECONDS = [
+    (r'/resourcegroups(/[^/]+)?$', 300),
+    (r'/providers/microsoft\.storage/storageaccounts(/[^/]+)?$', 600),
+    (r'/python[23]packages(/[^/]+)?$', 60),
+    (r'/runbooks/[^/]+/content$', 0),
+    (r'/runbooks(/[^/]+)?$', 60),
+]
+# Response headers kept with an entry
+_KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+class ArmReadCache(requests.adapters.HTTPAdapter):
+    """ Transport adapter that answers ARM GETs from a shared cache and revalidates them when they expire """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS, **kwargs):
+        requests.adapters.HTTPAdapter.__init__(self, **kwargs)
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.ttl_seconds = [(re.compile(pattern), seconds) for pattern, seconds in ttl_seconds]
+        self.counters = collections.OrderedDict(
+            (name, 0) for name in ('hits', 'revalidated', 'misses', 'invalidated', 'evicted'))
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = self._prepare_cache_dir()
+
+    def _prepare_cache_dir(self):
+        """ Creates the cache directory, or returns False to keep entries in memory only if there is none or it isn't safe to use """
+        if self.cache_dir is None:
+            return False
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, 0o700)
+            if hasattr(os, "getuid"):
+                if os.stat(self.cache_dir).st_uid != os.getuid():
+                    return False
+                os.chmod(self.cache_dir, 0o700)
+            return True
+        except OSError:
+            return False
+
+    def get_ttl(self, url):
+        """ Returns the time to live of a url, or None if it isn't cached """
+        path = urlsplit(url).path.lower().rstrip('/')
+        for pattern, seconds in self.ttl_seconds:
+            if pattern.search(path):
+                return seconds
+        return None
+
+    def summary(self):
+        return "ARM read cache: " + ", ".join("%d %s" % (count, name) for name, count in self.counters.items())
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    @staticmethod
+    def get_identity(request):
+        """ Returns the tenant and object id of the bearer token of a request, or a digest of its Authorization header """
+        authorization = request.headers.get('Authorization', '')
+        try:
+            payload = authorization.split(' ', 1)[-1].split('.')[1]
+            claims = json.loads(base64.urlsafe_b64decode(str(payload + '=' * (-len(payload) % 4))).decode('utf-8'))
+            return "%s/%s" % (claims['tid'], claims['oid'])
+        except (IndexError, ValueError, KeyError, TypeError):
+            return hashlib.sha1(authorization.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _folder(path):
+        return hashlib.sha1(path.lower().rstrip('/').encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        identity, url = key
+        # Entries are grouped by resource path, so a write drops them for every identity
+        return os.path.join(self.cache_dir, self._folder(urlsplit(url).path),
+                            hashlib.sha1((identity + " " + url).encode('utf-8')).hexdigest() + ".json")
+
+    def _load(self, key):
+        with self._lock:
+            if key in self._entries:
+                entry = self._entries.pop(key)
+                self._entries[key] = entry
+                return entry
+        if not self._disk:
+            return None
+        try:
+            with open(self._entry_path(key)) as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, OSError, ValueError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _store(self, key, entry):
+        self._remember(key, entry)
+        if not self._disk:
+            return
+        entry_path = self._entry_path(key)
+        try:
+            if not os.path.isdir(os.path.dirname(entry_path)):
+                os.makedirs(os.path.dirname(entry_path), 0o700)
+            # Write to a file of our own and move it into place so other jobs never read it half written
+            temp_fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(entry_path))
+            with os.fdopen(temp_fd, 'w') as entry_file:
+                json.dump(entry, entry_file)
+            if os.path.exists(entry_path):
+                os.remove(entry_path)
+            os.rename(temp_path, entry_path)
+        except (IOError, OSError):
+            return
+        self._evict()
+
+    def _evict(self):
+        """ Removes the least recently used entries on disk past max_entries """
+        entries = []
+        for folder, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    entry_path = os.path.join(folder, filename)
+                    try:
+                        entries.append((os.path.getmtime(entry_path), entry_path))
+                    except OSError:
+                        pass
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, entry_path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry_path)
+                self._count('evicted')
+            except OSError:
+                pass
+
+    def _touch(self, key):
+        if self._disk:
+            try:
+                os.utime(self._entry_path(key), None)
+            except OSError:
+                pass
+
+    def invalidate(self, url):
+        """ Drops every cached GET of a resource and of the listing it belongs to """
+        path = urlsplit(url).path.lower().rstrip('/')
+        paths = (path, path.rsplit('/', 1)[0])
+        with self._lock:
+            for key in [key for key in self._entries if urlsplit(key[1]).path.lower().rstrip('/') in paths]:
+                del self._entries[key]
+        if self._disk:
+            for invalidated_path in paths:
+                shutil.rmtree(os.path.join(self.cache_dir, self._folder(invalidated_path)), ignore_errors=True)
+        self._count('invalidated')
+
+    def _build_cached_response(self, request, entry):
+        response = requests.models.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        response._content = entry['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            if request.method in ('PUT', 'POST', 'PATCH', 'DELETE') and not request.url.lower().endswith(
+                    ('/listkeys', '/regeneratekey')) and '/listkeys?' not in request.url.lower():
+                self.invalidate(request.url)
+            return requests.adapters.HTTPAdapter.send(self, request, **kwargs)
+        ttl = self.get_ttl(request.url)
+        if ttl is None or kwargs.get('stream'):
+            return requests.adapters.HTTPAdapter.send(self, request, **kwargs)
+
+        key = (self.get_identity(request), request.url)
+        entry = self._load(key)
+        no_cache = 'no-cache' in request.headers.get('Cache-Control', '')
+        if entry is not None and not no_cache and time.time() - entry['stored_at'] < ttl:
+            self._touch(key)
+            self._count('hits')
+            return self._build_cached_response(request, entry)
+        if entry is not None:
+            if entry['headers'].get('ETag'):
+                request.headers['If-None-Match'] = entry['headers']['ETag']
+            if entry['headers'].get('Last-Modified'):
+                request.headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+
+        response = requests.adapters.HTTPAdapter.send(self, request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            entry['stored_at'] = time.time()
+            self._store(key, entry)
+            self._count('revalidated')
+            return self._build_cached_response(request, entry)
+        self._count('misses')
+        if response.status_code == 200:
+            try:
+                body = response.content.decode('utf-8')
+            except UnicodeDecodeError:
+                return response
+            self._store(key, {
+                'stored_at': time.time(), 'body': body,
+                'headers': dict((name, response.headers[name]) for name in _KEPT_HEADERS if name in response.headers)})
+        return response
+
+
+# One cache per process, shared by every session it is mounted on
+_shared_cache = []
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """ Returns the cache shared by all sessions of this process, creating it on first use """
+    with _shared_cache_lock:
+        if not _shared_cache:
+            _shared_cache.append(ArmReadCache())
+        return _shared_cache[0]
+
+
+def mount(session, cache=None):
+    """ Sends the ARM requests of a session through the shared cache, or the one given, and returns it """
+    cache = cache or get_shared_cache()
+    session.mount(ARM_ENDPOINT, cache)
+    return cache
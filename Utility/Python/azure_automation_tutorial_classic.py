@@ -1,43 +1,85 @@
 """ Tutorial to show how to authenticate against Azure service management resources """
 #!/usr/bin/env python2
+import hashlib
 import tempfile
 import os
 import OpenSSL
 import azure.servicemanagement
 import automationassets
 
-def get_certificate_file(classic_run_as_connection):
-    """ Returns a certificate file to authenticate against Azure service management resources """
+# Directory only this user can read, holding one PEM file per connection and certificate
+_PEM_CACHE_DIR = os.path.join(tempfile.gettempdir(), "automation_pem_cache")
+
+# Service management clients by (subscription id, PEM file)
+_service_management_clients = {}
+
+def get_pem_cache_dir():
+    """ Returns the PEM cache directory, creating it if needed and checking no one else can use it """
+    try:
+        os.mkdir(_PEM_CACHE_DIR, 0o700)
+    except OSError:
+        if not os.path.isdir(_PEM_CACHE_DIR):
+            raise
+    if hasattr(os, "getuid"):
+        if os.stat(_PEM_CACHE_DIR).st_uid != os.getuid():
+            raise OSError("PEM cache directory " + _PEM_CACHE_DIR + " is owned by another user")
+        os.chmod(_PEM_CACHE_DIR, 0o700)
+    return _PEM_CACHE_DIR
+
+def get_certificate_file(connection_name, classic_run_as_connection):
+    """
+    Returns the path of a PEM file to authenticate against Azure service management resources.
+    The file is named after the connection and a digest of its certificate asset, and reused until the asset changes
+    """
     cert = automationassets.get_automation_certificate(
         classic_run_as_connection["CertificateAssetName"])
+    # Key on the asset as stored, so an unchanged certificate doesn't need decoding again
+    prefix = hashlib.sha1(connection_name).hexdigest() + "-"
+    digest = hashlib.sha1(cert).hexdigest()
+    cache_dir = get_pem_cache_dir()
+    pem_path = os.path.join(cache_dir, prefix + digest + ".pem")
+    if os.path.isfile(pem_path):
+        return pem_path
+
     sp_cert = OpenSSL.crypto.load_pkcs12(cert)
-    temp_pem_file = tempfile.NamedTemporaryFile(suffix='.pem', delete=False)
-    temp_pem_file.write(OpenSSL.crypto.dump_privatekey(
-        OpenSSL.crypto.FILETYPE_PEM, sp_cert.get_privatekey()))
-    temp_pem_file.write(OpenSSL.crypto.dump_certificate(
-        OpenSSL.crypto.FILETYPE_PEM, sp_cert.get_certificate()))
-    temp_pem_file.close()
-    return temp_pem_file
-
-try:
-    # get Azure classic run as connection
-    automation_classic_run_as_connection = automationassets.get_automation_connection(
-        "AzureClassicRunAsConnection")
-
-    # get certificate from the service that is used for authentication
-    pem_file = None
-    pem_file = get_certificate_file(automation_classic_run_as_connection)
-
-    # authenticate against the serivce management api
-    service_management_client = azure.servicemanagement.ServiceManagementService(
-        automation_classic_run_as_connection["SubscriptionId"], pem_file.name)
+    pem = (OpenSSL.crypto.dump_privatekey(OpenSSL.crypto.FILETYPE_PEM, sp_cert.get_privatekey())
+           + OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, sp_cert.get_certificate()))
+
+    # Write to a file only this user can read, then move it into place so no job sees it half written
+    temp_fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    try:
+        os.write(temp_fd, pem)
+    finally:
+        os.close(temp_fd)
+    if os.path.exists(pem_path):
+        os.remove(temp_path)
+    else:
+        os.rename(temp_path, pem_path)
+
+    # Remove PEM files of certificates this connection used before, leaving other connections' alone
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith(".pem") and name != prefix + digest + ".pem":
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+    return pem_path
+
+def get_service_management_client(connection_name="AzureClassicRunAsConnection"):
+    """ Returns a service management client for a classic run as connection, reused while its certificate is unchanged """
+    classic_run_as_connection = automationassets.get_automation_connection(connection_name)
+    subscription_id = classic_run_as_connection["SubscriptionId"]
+    pem_path = get_certificate_file(connection_name, classic_run_as_connection)
+    if (subscription_id, pem_path) not in _service_management_clients:
+        _service_management_clients[(subscription_id, pem_path)] = (
+            azure.servicemanagement.ServiceManagementService(subscription_id, pem_path))
+    return _service_management_clients[(subscription_id, pem_path)]
+
+if __name__ == '__main__':
+    # authenticate against the serivce management api with the Azure classic run as connection
+    service_management_client = get_service_management_client()
 
     # get list of hosted services and print out each service name
     hosted_services = service_management_client.list_hosted_services()
     for hosted_service in hosted_services:
         print hosted_service.service_name
-
-finally:
-    # remove temp pem file created
-    if pem_file is not None:
-        os.remove(pem_file.name)
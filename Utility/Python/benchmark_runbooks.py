@@ -0,0 +1,715 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the storage, package import and job management runbooks offline.
+
+Every scenario runs a runbook in its own process against local stand-in servers for
+Azure Resource Manager, the Automation REST API, Blob storage, a PyPI simple index
+and the managed identity / Azure AD token endpoints. All https calls the runbook makes
+through requests are sent to the stand-ins instead, so nothing leaves the machine.
+The stand-ins can add latency to every response and throttle each service with 429s.
+
+Waits the runbooks are built around, such as the import rate limit of the Automation
+account and job polling intervals, are multiplied by the time scale so that a scenario
+finishes in seconds. Stand-in imports and jobs take a scaled minute to complete.
+
+For every scenario and size it reports throughput, latency percentiles of the HTTP
+requests the runbook made, the number of requests, and the peak memory of the process.
+Results can be saved and later compared against, failing when throughput or peak
+memory regress by more than the threshold.
+
+Args:
+    scenarios (-s) - comma separated scenarios to run, all of them by default:
+                     pypi-resolve, py3-import, remove-packages, jobs, job-output, blob-download
+    sizes (-z) - comma separated sizes to run out of small, medium and large. Default is small,medium
+    latency (-l) - milliseconds added to every stand-in response. Default is 20
+    throttle (-t) - requests per second each stand-in service accepts before answering 429. Default is no limit
+    time_scale (-x) - factor applied to the waits in the runbooks. Default is 0.01
+    python2 (-2) - Python 2 interpreter to run the Python 2 runbooks with. Default is python2
+    save (-o) - file to save the results to as json, to use as a baseline later
+    baseline (-b) - file of saved results to compare against
+    threshold (-r) - fraction throughput or peak memory may regress by before failing. Default is 0.2
+
+    Run the small scenarios and save a baseline
+    Example 1:
+            benchmark_runbooks.py -z small -o baseline.json
+
+    Compare a change against the baseline with 50 ms of latency on every request
+    Example 2:
+            benchmark_runbooks.py -z small -l 50 -b baseline.json
+
+Changelog:
+    2026-10-19 AutomationTeam:
+    -initial script
+
+"""
+import base64
+import collections
+import email.utils
+import getopt
+import hashlib
+import http.server
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+RUNBOOK_DIR = os.path.dirname(os.path.abspath(__file__))
+SIZES = ('small', 'medium', 'large')
+# Each dependency in the stand-in index requires this many packages on the next level down
+TREE_FANOUT = 3
+# Items returned per page by the stand-in listings
+PAGE_SIZE = 100
+# Seconds a stand-in import or job takes before the time scale is applied
+OPERATION_SECONDS = 60
+BLOB_SIZE = 64 * 1024
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+RESOURCE_GROUP = "benchmark"
+AUTOMATION_ACCOUNT = "benchmark"
+STORAGE_ACCOUNT = "benchmarkstore"
+CONTAINER = "data"
+OUTPUT_JOB_ID = "00000000-0000-0000-0000-00000000cafe"
+SCENARIO_TIMEOUT_SECONDS = 1800
+
+Scenario = collections.namedtuple('Scenario', ['python', 'unit', 'sizes', 'prepare', 'driver'])
+
+
+class StandinState(object):
+    """ Everything the stand-in services know, shared by all request threads """
+    def __init__(self, latency, throttle, time_scale):
+        self.latency = latency
+        self.throttle = throttle
+        self.operation_seconds = OPERATION_SECONDS * time_scale
+        self.tree_depth = 0
+        self.packages = {'python2Packages': {}, 'python3Packages': {}}
+        self.jobs = {}
+        self.streams = {}
+        self.blobs = []
+        self.blob_content = b''
+        self.lock = threading.Lock()
+        self._buckets = {}
+
+    def throttled(self, service):
+        """ Returns the seconds to ask the caller to retry after if the service is over its rate, otherwise 0 """
+        if not self.throttle:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(service, (self.throttle, now))
+            tokens = min(self.throttle, tokens + (now - updated) * self.throttle)
+            if tokens < 1:
+                self._buckets[service] = (tokens, now)
+                return max(1, int(math.ceil((1 - tokens) / self.throttle)))
+            self._buckets[service] = (tokens - 1, now)
+            return 0
+
+    def package_state(self, package):
+        if package['properties']['provisioningState'] == 'Creating' and time.monotonic() >= package['ready_at']:
+            package['properties']['provisioningState'] = 'Succeeded'
+        return dict((key, value) for key, value in package.items() if key != 'ready_at')
+
+    def job_state(self, job):
+        elapsed = time.monotonic() - job['created']
+        properties = dict(job['properties'])
+        if elapsed >= self.operation_seconds:
+            properties['status'] = 'Completed'
+        elif elapsed >= self.operation_seconds / 10:
+            properties['status'] = 'Running'
+        if properties['status'] != 'New':
+            properties['startTime'] = job['start_time']
+        return {'id': job['id'], 'properties': properties}
+
+
+class StandinRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves https://<host>/<path> requests sent to http://<stand-in>/<host>/<path> """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_HEAD(self):
+        self.dispatch('HEAD')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        url = urllib.parse.urlsplit(self.path)
+        host, _, path = url.path.lstrip('/').partition('/')
+        query = dict((key, values[0]) for key, values in urllib.parse.parse_qs(url.query).items())
+        if state.latency:
+            time.sleep(state.latency)
+        service = 'blob' if host.endswith('.blob.core.windows.net') else host
+        if service in ('management.azure.com', 'pypi.org', 'blob'):
+            retry_after = state.throttled(service)
+            if retry_after:
+                self.reply(429, {'error': {'code': 'TooManyRequests', 'message': 'Rate limit exceeded'}},
+                           {'Retry-After': str(retry_after)})
+                return
+        handlers = {'identity': self.identity, 'login.microsoftonline.com': self.login,
+                    'pypi.org': self.pypi, 'management.azure.com': self.arm, 'blob': self.blob}
+        if service not in handlers:
+            self.reply(404, {'error': {'code': 'NotFound', 'message': host + ' has no stand-in'}})
+            return
+        handlers[service](method, host, '/' + path, query, body)
+
+    def reply(self, status, content=None, headers=None, content_type='application/json'):
+        if isinstance(content, (dict, list)):
+            content = json.dumps(content).encode('utf-8')
+        elif isinstance(content, str):
+            content = content.encode('utf-8')
+        content = content or b''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if 'Content-Length' not in (headers or {}):
+            self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    def next_link(self, host, path, query, skip, total):
+        if skip + PAGE_SIZE >= total:
+            return None
+        query = dict(query, **{'$skip': str(skip + PAGE_SIZE)})
+        return 'https://' + host + path + '?' + urllib.parse.urlencode(query)
+
+    def identity(self, method, host, path, query, body):
+        self.reply(200, {'access_token': 'benchmark-token', 'expires_on': str(int(time.time()) + 3600),
+                         'resource': query.get('resource'), 'token_type': 'Bearer'})
+
+    def login(self, method, host, path, query, body):
+        self.reply(200, {'token_type': 'Bearer', 'expires_in': '3600', 'ext_expires_in': '3600',
+                         'expires_on': str(int(time.time()) + 3600), 'not_before': str(int(time.time())),
+                         'resource': 'https://management.core.windows.net/', 'access_token': 'benchmark-token'})
+
+    def pypi(self, method, host, path, query, body):
+        """ Simple index of a dependency tree pkg-<level>-<index>, TREE_FANOUT wide and tree_depth deep """
+        state = self.server.state
+        match = re.match(r'^/simple/pkg-(\d+)-(\d+)/$', path)
+        if match:
+            project = 'pkg-%s-%s' % match.groups()
+            etag = '"%s-%d"' % (project, state.tree_depth)
+            if self.headers.get('If-None-Match') == etag:
+                self.reply(304, headers={'ETag': etag})
+                return
+            files = []
+            for version in ('1.0.0', '1.1.0', '2.0.0'):
+                stem = '%s-%s' % (project.replace('-', '_'), version)
+                for tags in ('cp38-cp38-manylinux2014_x86_64', 'cp38-cp38-win_amd64', 'py3-none-any'):
+                    files.append({'filename': '%s-%s.whl' % (stem, tags), 'hashes': {}, 'requires-python': '>=3.6',
+                                  'url': 'https://pypi.org/files/%s-%s.whl' % (stem, tags), 'core-metadata': True})
+                files.append({'filename': stem + '.tar.gz', 'url': 'https://pypi.org/files/%s.tar.gz' % stem,
+                              'hashes': {}, 'requires-python': '>=3.6'})
+            self.reply(200, {'meta': {'api-version': '1.0'}, 'name': project, 'files': files}, {'ETag': etag},
+                       'application/vnd.pypi.simple.v1+json')
+            return
+        match = re.match(r'^/files/pkg_(\d+)_(\d+)-([^-]+)-.*\.whl\.metadata$', path)
+        if match:
+            level, index, version = int(match.group(1)), int(match.group(2)), match.group(3)
+            lines = ['Metadata-Version: 2.1', 'Name: pkg-%d-%d' % (level, index), 'Version: ' + version]
+            if level < state.tree_depth:
+                lines += ['Requires-Dist: pkg-%d-%d (>=1.0)' % (level + 1, index * TREE_FANOUT + child)
+                          for child in range(TREE_FANOUT)]
+            # Never applies to the Python 3 target, so resolving it would be a bug
+            lines.append('Requires-Dist: legacy-backport ; python_version < "3"')
+            self.reply(200, '\n'.join(lines) + '\n', content_type='text/plain')
+            return
+        if path.startswith('/files/'):
+            self.reply(200, b'PK\x05\x06' + b'\x00' * 18, content_type='application/octet-stream')
+            return
+        self.reply(404, 'Not Found', content_type='text/plain')
+
+    def arm(self, method, host, path, query, body):
+        state = self.server.state
+        match = re.match(r'^/subscriptions/[^/]+/resourceGroups/[^/]+/providers/Microsoft.Storage/storageAccounts/'
+                         r'[^/]+/listKeys$', path)
+        if match:
+            key = base64.b64encode(b'benchmark' * 8).decode('ascii')
+            self.reply(200, {'keys': [{'keyName': 'key1', 'value': key, 'permissions': 'FULL'}]})
+            return
+        match = re.match(r'^/subscriptions/[^/]+/resourceGroups/[^/]+/providers/Microsoft.Automation/'
+                         r'automationAccounts/[^/]+/(.*)$', path)
+        if not match:
+            self.reply(404, {'error': {'code': 'NotFound', 'message': path}})
+            return
+        resource = match.group(1)
+        with state.lock:
+            match = re.match(r'^(python[23]Packages)(?:/([^/]+))?$', resource)
+            if match:
+                self.arm_packages(method, host, path, query, body, state.packages[match.group(1)], match.group(2))
+                return
+            match = re.match(r'^jobs/\(([^)]+)\)$', resource)
+            if match:
+                self.arm_job(method, body, match.group(1))
+                return
+            if resource == 'jobs':
+                # Listed by creation time, so jobs show up as soon as they are created
+                jobs = [state.job_state(job) for job in state.jobs.values()]
+                skip = int(query.get('$skip', 0))
+                self.reply(200, {'value': jobs[skip:skip + PAGE_SIZE],
+                                 'nextLink': self.next_link(host, path, query, skip, len(jobs))})
+                return
+            match = re.match(r'^jobs/([^/]+)/streams(?:/([^/]+))?$', resource)
+            if match and match.group(2):
+                self.reply(200, {'properties': {'jobStreamId': match.group(2),
+                                                'streamText': 'Output record ' + match.group(2)}})
+                return
+            if match:
+                records = state.streams.get(match.group(1), [])
+                stream_filter = query.get('$filter', '')
+                since = re.search(r"properties/time ge (\S+)", stream_filter)
+                if since:
+                    records = [record for record in records if record['properties']['time'] >= since.group(1)]
+                skip = int(query.get('$skip', 0))
+                self.reply(200, {'value': records[skip:skip + PAGE_SIZE],
+                                 'nextLink': self.next_link(host, path, query, skip, len(records))})
+                return
+        self.reply(404, {'error': {'code': 'NotFound', 'message': resource}})
+
+    def arm_packages(self, method, host, path, query, body, packages, name):
+        state = self.server.state
+        if name is None:
+            listing = [state.package_state(package) for package in packages.values()]
+            skip = int(query.get('$skip', 0))
+            self.reply(200, {'value': listing[skip:skip + PAGE_SIZE],
+                             'nextLink': self.next_link(host, path, query, skip, len(listing))})
+        elif method == 'PUT':
+            uri = json.loads(body.decode('utf-8'))['properties']['contentLink']['uri']
+            version = uri.rsplit('/', 1)[-1].split('-')[1]
+            packages[name] = {'name': name, 'ready_at': time.monotonic() + state.operation_seconds,
+                              'properties': {'provisioningState': 'Creating', 'version': version}}
+            self.reply(201, state.package_state(packages[name]))
+        elif name not in packages:
+            self.reply(404, {'error': {'code': 'NotFound', 'message': name + ' not found'}})
+        elif method == 'DELETE':
+            del packages[name]
+            self.reply(200)
+        else:
+            self.reply(200, state.package_state(packages[name]))
+
+    def arm_job(self, method, body, job_id):
+        state = self.server.state
+        if method == 'PUT':
+            properties = json.loads(body.decode('utf-8'))['properties']
+            state.jobs[job_id] = {'id': job_id, 'created': time.monotonic(),
+                                  'start_time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                                  'properties': {'jobId': job_id, 'status': 'New', 'runbook': properties['runbook'],
+                                                 'creationTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}}
+            self.reply(201, state.job_state(state.jobs[job_id]))
+        elif job_id in state.jobs:
+            self.reply(200, state.job_state(state.jobs[job_id]))
+        else:
+            self.reply(404, {'error': {'code': 'NotFound', 'message': job_id + ' not found'}})
+
+    def blob(self, method, host, path, query, body):
+        state = self.server.state
+        content_md5 = base64.b64encode(hashlib.md5(state.blob_content).digest()).decode('ascii')
+        last_modified = email.utils.formatdate(usegmt=True)
+        if query.get('comp') == 'list':
+            start = int(query.get('marker') or 0)
+            page = state.blobs[start:start + int(query.get('maxresults', 5000))]
+            entries = ''.join(
+                '<Blob><Name>%s</Name><Properties><Last-Modified>%s</Last-Modified><Etag>"0x8D000000000000%d"</Etag>'
+                '<Content-Length>%d</Content-Length><Content-Type>application/octet-stream</Content-Type>'
+                '<Content-MD5>%s</Content-MD5><BlobType>BlockBlob</BlobType><LeaseStatus>unlocked</LeaseStatus>'
+                '<LeaseState>available</LeaseState></Properties></Blob>'
+                % (name, last_modified, index, len(state.blob_content), content_md5)
+                for index, name in enumerate(page))
+            next_marker = str(start + len(page)) if start + len(page) < len(state.blobs) else ''
+            self.reply(200, '<?xml version="1.0" encoding="utf-8"?><EnumerationResults ServiceEndpoint="https://%s/" '
+                            'ContainerName="%s"><Blobs>%s</Blobs><NextMarker>%s</NextMarker></EnumerationResults>'
+                       % (host, CONTAINER, entries, next_marker), {'x-ms-version': '2018-03-28'}, 'application/xml')
+            return
+        name = path.split('/', 2)[-1]
+        if name not in state.blobs:
+            self.reply(404, '', {'x-ms-error-code': 'BlobNotFound'}, 'application/xml')
+            return
+        headers = {'ETag': '"0x8D0000000000000"', 'Last-Modified': last_modified, 'x-ms-blob-type': 'BlockBlob',
+                   'Accept-Ranges': 'bytes', 'x-ms-version': self.headers.get('x-ms-version', '2018-03-28'),
+                   'x-ms-request-id': '00000000-0000-0000-0000-000000000000', 'Content-MD5': content_md5}
+        content = state.blob_content
+        requested = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('x-ms-range') or self.headers.get('Range') or '')
+        if requested:
+            first = int(requested.group(1))
+            last = min(int(requested.group(2) or len(content) - 1), len(content) - 1)
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (first, last, len(content))
+            if self.headers.get('x-ms-range-get-content-md5') != 'true':
+                del headers['Content-MD5']
+            else:
+                headers['Content-MD5'] = base64.b64encode(hashlib.md5(content[first:last + 1]).digest()).decode('ascii')
+            content = content[first:last + 1]
+        if method == 'HEAD':
+            headers['Content-Length'] = str(len(content))
+        self.reply(206 if requested else 200, content, headers, 'application/octet-stream')
+
+
+class StandinServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, state):
+        http.server.ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), StandinRequestHandler)
+        self.state = state
+
+
+# Runs first in every scenario process: sends all https requests to the stand-ins and times them,
+# provides the automationassets module of the Automation sandbox and reports the results as json
+CHILD_BOOTSTRAP = r'''
+import json, os, sys, tempfile, time, types
+config = json.loads(os.environ["BENCHMARK_CONFIG"])
+sys.path.insert(0, config["runbook_dir"])
+
+import requests.adapters
+latencies = []
+_send = requests.adapters.HTTPAdapter.send
+def _standin_send(self, request, **kwargs):
+    if not request.url.startswith(config["standin"]):
+        request.url = config["standin"] + "/" + request.url.split("://", 1)[1]
+    started = time.time()
+    try:
+        return _send(self, request, **kwargs)
+    finally:
+        latencies.append(time.time() - started)
+requests.adapters.HTTPAdapter.send = _standin_send
+
+
+def _certificate():
+    from OpenSSL import crypto
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    cert = crypto.X509()
+    cert.get_subject().CN = "benchmark"
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(3600)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, "sha256")
+    pkcs12 = crypto.PKCS12()
+    pkcs12.set_privatekey(key)
+    pkcs12.set_certificate(cert)
+    return pkcs12.export()
+
+automationassets = types.ModuleType("automationassets")
+automationassets.get_automation_connection = lambda name: {
+    "SubscriptionId": config["subscription_id"], "ApplicationId": "benchmark", "TenantId": "benchmark",
+    "CertificateThumbprint": "benchmark"}
+automationassets.get_automation_certificate = lambda name: _certificate()
+sys.modules["automationassets"] = automationassets
+
+
+class BenchmarkCredential(object):
+    """ Stands in for the RunAs credential of runbooks that take one """
+    def get_token(self, force_refresh=False):
+        return "benchmark-token"
+
+# Keep the runbook's own output out of the result
+result_stream = os.fdopen(os.dup(1), "w")
+os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+
+
+def report(items, seconds, errors=0, skipped=None):
+    try:
+        import resource
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak_kb //= 1024
+    except ImportError:
+        peak_kb = None
+    result_stream.write(json.dumps({"items": items, "seconds": seconds, "errors": errors, "skipped": skipped,
+                                    "latencies": latencies, "peak_kb": peak_kb}) + "\n")
+    result_stream.flush()
+
+size = config["size"]
+scale = config["time_scale"]
+'''
+
+PYPI_RESOLVE_DRIVER = r'''
+import import_py3package_from_pypi as runbook
+runbook.package_index = runbook.PackageIndex(runbook.PYPI_ENDPOINT, tempfile.mkdtemp())
+started = time.time()
+dep_map = runbook.resolve_dependencies("pkg-0-0", "2.0.0")
+report(len(dep_map), time.time() - started)
+'''
+
+PY3_IMPORT_DRIVER = r'''
+import collections
+import import_py3package_from_pypi as runbook
+runbook.subscription_id = config["subscription_id"]
+runbook.resource_group = config["resource_group"]
+runbook.automation_account = config["automation_account"]
+runbook.IMPORT_RATE_PERIOD_SECONDS *= scale
+runbook.IMPORT_POLL_INITIAL_SECONDS *= scale
+runbook.IMPORT_POLL_MAX_SECONDS *= scale
+runbook.import_rate_limiter = runbook.RateLimiter(runbook.IMPORT_RATE_LIMIT, runbook.IMPORT_RATE_PERIOD_SECONDS)
+runbook.package_index = runbook.PackageIndex(runbook.PYPI_ENDPOINT, tempfile.mkdtemp())
+dep_map = collections.OrderedDict(("pkg-1-%d" % index, "2.0.0") for index in range(size))
+started = time.time()
+try:
+    runbook.import_packages(dep_map)
+    errors = 0
+except Exception as e:
+    errors = str(e).count(",") + 1
+report(len(dep_map), time.time() - started, errors)
+'''
+
+REMOVE_PACKAGES_DRIVER = r'''
+import remove_python2package as runbook
+runbook.subscription_id = config["subscription_id"]
+runbook.resource_group = config["resource_group"]
+runbook.automation_account = config["automation_account"]
+runbook.package_type = "python2Packages"
+runbook.token = "benchmark-token"
+started = time.time()
+names = [package["name"] for package in runbook.get_all_packages()]
+failed = runbook.remove_packages(names)
+report(len(names), time.time() - started, len(failed))
+'''
+
+JOBS_DRIVER = r'''
+import sample_rest_call as runbook
+runbook._POLL_INITIAL_SECONDS *= scale
+runbook._POLL_MAX_SECONDS *= scale
+runbook._JOB_SUBMIT_PERIOD_SECONDS *= scale
+orchestrator = runbook.JobOrchestrator(BenchmarkCredential(), config["subscription_id"], config["resource_group"],
+                                       config["automation_account"])
+jobs = [("hello_world_python", {"[PARAMETER 1]": "-n", "[PARAMETER 2]": str(index)}) for index in range(size)]
+started = time.time()
+errors = sum(1 for result in orchestrator.run(jobs) if result.exception is not None)
+report(len(jobs), time.time() - started, errors)
+'''
+
+JOB_OUTPUT_DRIVER = r'''
+import sample_rest_call as runbook
+orchestrator = runbook.JobOrchestrator(BenchmarkCredential(), config["subscription_id"], config["resource_group"],
+                                       config["automation_account"])
+started = time.time()
+written = orchestrator.write_job_output(config["output_job_id"], open(os.devnull, "w"))
+report(written, time.time() - started, size - written)
+'''
+
+BLOB_DOWNLOAD_DRIVER = r'''
+import runpy
+try:
+    import adal, OpenSSL, azure.mgmt.storage, azure.storage.blob
+except ImportError as e:
+    report(0, 0, skipped=str(e))
+    sys.exit(0)
+local_path = tempfile.mkdtemp()
+sys.argv = ["download_storage_container.py", "-p", local_path, "-r", config["resource_group"],
+            "-a", config["storage_account"], "-c", config["container"]]
+started = time.time()
+runpy.run_path(os.path.join(config["runbook_dir"], "download_storage_container.py"), run_name="__main__")
+downloaded = sum(len(files) for _, _, files in os.walk(local_path))
+report(downloaded, time.time() - started, size - downloaded)
+'''
+
+
+def prepare_tree(state, depth):
+    state.tree_depth = depth
+
+
+def prepare_import(state, count):
+    state.tree_depth = 1
+
+
+def prepare_packages(state, count):
+    for index in range(count):
+        name = 'pkg%d' % index
+        state.packages['python2Packages'][name] = {
+            'name': name, 'ready_at': 0, 'properties': {'provisioningState': 'Succeeded', 'version': '1.0.0'}}
+
+
+def prepare_jobs(state, count):
+    pass
+
+
+def prepare_output(state, count):
+    state.streams[OUTPUT_JOB_ID] = [
+        {'properties': {'jobStreamId': '%s:%08d' % (OUTPUT_JOB_ID, index), 'streamType': 'Output', 'summary': '',
+                        'time': '2026-10-19T00:%02d:%02d.%06d+00:00' % (index // 60000 % 60, index // 1000 % 60,
+                                                                          index % 1000)}}
+        for index in range(count)]
+
+
+def prepare_blobs(state, count):
+    state.blob_content = os.urandom(BLOB_SIZE)
+    state.blobs = ['folder%d/blob%d.bin' % (index % 10, index) for index in range(count)]
+
+
+SCENARIOS = collections.OrderedDict([
+    ('pypi-resolve', Scenario(3, 'packages', {'small': 2, 'medium': 4, 'large': 6}, prepare_tree, PYPI_RESOLVE_DRIVER)),
+    ('py3-import', Scenario(3, 'packages', {'small': 10, 'medium': 50, 'large': 200}, prepare_import, PY3_IMPORT_DRIVER)),
+    ('remove-packages', Scenario(2, 'packages', {'small': 50, 'medium': 250, 'large': 1000}, prepare_packages,
+                                 REMOVE_PACKAGES_DRIVER)),
+    ('jobs', Scenario(2, 'jobs', {'small': 20, 'medium': 100, 'large': 400}, prepare_jobs, JOBS_DRIVER)),
+    ('job-output', Scenario(2, 'records', {'small': 500, 'medium': 5000, 'large': 20000}, prepare_output,
+                            JOB_OUTPUT_DRIVER)),
+    ('blob-download', Scenario(2, 'blobs', {'small': 20, 'medium': 200, 'large': 1000}, prepare_blobs,
+                               BLOB_DOWNLOAD_DRIVER)),
+])
+
+
+def percentile(values, fraction):
+    """ Returns the nearest-rank percentile of sorted values """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(math.ceil(fraction * len(values))) - 1)]
+
+
+def run_scenario(name, size, latency, throttle, time_scale, python2):
+    """ Runs one scenario at one size against fresh stand-ins and returns its measurements """
+    scenario = SCENARIOS[name]
+    state = StandinState(latency, throttle, time_scale)
+    scenario.prepare(state, scenario.sizes[size])
+    server = StandinServer(state)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    standin = 'http://127.0.0.1:%d' % server.server_port
+    config = {'runbook_dir': RUNBOOK_DIR, 'standin': standin, 'size': scenario.sizes[size], 'time_scale': time_scale,
+              'subscription_id': SUBSCRIPTION_ID, 'resource_group': RESOURCE_GROUP,
+              'automation_account': AUTOMATION_ACCOUNT, 'storage_account': STORAGE_ACCOUNT, 'container': CONTAINER,
+              'output_job_id': OUTPUT_JOB_ID}
+    env = dict(os.environ, BENCHMARK_CONFIG=json.dumps(config), IDENTITY_ENDPOINT=standin + '/identity',
+               IDENTITY_HEADER='benchmark')
+    interpreter = sys.executable if scenario.python == 3 else python2
+    try:
+        process = subprocess.run([interpreter, '-c', CHILD_BOOTSTRAP + scenario.driver], env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=SCENARIO_TIMEOUT_SECONDS)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return {'error': str(e)}
+    finally:
+        server.shutdown()
+        server.server_close()
+    lines = process.stdout.decode('utf-8', 'replace').strip().splitlines()
+    if process.returncode != 0 or not lines:
+        stderr = process.stderr.decode('utf-8', 'replace').strip().splitlines()
+        return {'error': stderr[-1] if stderr else 'exited with code %d' % process.returncode}
+    measured = json.loads(lines[-1])
+    if measured['skipped']:
+        return {'skipped': measured['skipped']}
+    latencies = sorted(measured['latencies'])
+    return {
+        'unit': scenario.unit,
+        'items': measured['items'],
+        'errors': measured['errors'],
+        'seconds': round(measured['seconds'], 3),
+        'throughput': round(measured['items'] / measured['seconds'], 2) if measured['seconds'] else None,
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        'p90_ms': round(percentile(latencies, 0.9) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        'peak_mb': round(measured['peak_kb'] / 1024.0, 1) if measured['peak_kb'] else None,
+    }
+
+
+def compare(result, baseline, threshold):
+    """ Returns the change in throughput and peak memory against a baseline, and whether either regressed """
+    changes = []
+    regressed = False
+    for field, worse in (('throughput', -1), ('peak_mb', 1)):
+        if result.get(field) and baseline.get(field):
+            change = (result[field] - baseline[field]) / baseline[field]
+            changes.append('%s %+.0f%%' % ('tput' if field == 'throughput' else 'mem', change * 100))
+            regressed = regressed or change * worse > threshold
+    return ', '.join(changes), regressed
+
+
+def format_value(value):
+    return '-' if value is None else str(value)
+
+
+if __name__ == '__main__':
+    # Process any arguments sent in
+    scenarios = list(SCENARIOS)
+    sizes = ['small', 'medium']
+    latency = 0.02
+    throttle = None
+    time_scale = 0.01
+    python2 = 'python2'
+    save_path = None
+    baseline_path = None
+    threshold = 0.2
+
+    opts, args = getopt.getopt(sys.argv[1:], "s:z:l:t:x:2:o:b:r:")
+    for o, a in opts:
+        if o == '-s':
+            scenarios = a.split(',')
+        elif o == '-z':
+            sizes = a.split(',')
+        elif o == '-l':
+            latency = float(a) / 1000
+        elif o == '-t':
+            throttle = float(a)
+        elif o == '-x':
+            time_scale = float(a)
+        elif o == '-2':
+            python2 = a
+        elif o == '-o':
+            save_path = a
+        elif o == '-b':
+            baseline_path = a
+        elif o == '-r':
+            threshold = float(a)
+
+    unknown = [name for name in scenarios if name not in SCENARIOS] + [size for size in sizes if size not in SIZES]
+    if unknown:
+        raise ValueError("Unknown scenarios or sizes: " + ", ".join(unknown))
+
+    baseline = {}
+    if baseline_path is not None:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    columns = ('scenario', 'size', 'items', 'errors', 'seconds', 'items/s', 'requests', 'p50 ms', 'p90 ms', 'p99 ms',
+               'peak MB', 'vs baseline')
+    row_format = '%-16s %-7s %7s %6s %8s %9s %8s %7s %7s %7s %8s  %s'
+    print(row_format % columns)
+    results = collections.OrderedDict()
+    regressions = []
+    for name in scenarios:
+        for size in sizes:
+            key = name + '/' + size
+            result = run_scenario(name, size, latency, throttle, time_scale, python2)
+            results[key] = result
+            if 'error' in result or 'skipped' in result:
+                print(row_format % ((name, size) + ('-',) * 9 + (result.get('error') or 'skipped: ' + result['skipped'],)))
+                continue
+            comparison = ''
+            if key in baseline and 'throughput' in baseline[key]:
+                comparison, regressed = compare(result, baseline[key], threshold)
+                if regressed:
+                    regressions.append(key)
+                    comparison += ' REGRESSED'
+            print(row_format % ((name, size) + tuple(format_value(result[field]) for field in (
+                'items', 'errors', 'seconds', 'throughput', 'requests', 'p50_ms', 'p90_ms', 'p99_ms', 'peak_mb'))
+                + (comparison,)))
+            sys.stdout.flush()
+
+    if save_path is not None:
+        with open(save_path, 'w') as save_file:
+            json.dump({'settings': {'latency_ms': latency * 1000, 'throttle': throttle, 'time_scale': time_scale},
+                       'results': results}, save_file, indent=2)
+        print("Saved results to " + save_path)
+    if regressions:
+        print("Regressed by more than %d%%: %s" % (threshold * 100, ", ".join(regressions)))
+        sys.exit(1)
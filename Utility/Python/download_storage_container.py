@@ -9,6 +9,7 @@ Args:
     storage_account_name (-a) - storage account name
     storage_account_container_name (-c) - container name
     blob_name (-b) - optional name of a blob
+    extract_archives (-x) - extract .zip, .tar, .tar.gz, .tgz and .gz blobs while they download instead of saving them, using storage_blob_helpers
 
     Copy a specific blob to a local directory
     Example 1:
@@ -18,9 +19,17 @@ Args:
     Example 2:
             download_storage_container.py -p <local_file_path> -r <resource_group> -a <storage_account_name> -c <storage_account_container_name>
 
+    Download all files in a container, extracting archives into the directory they are in
+    Example 3:
+            download_storage_container.py -p <local_file_path> -r <resource_group> -a <storage_account_name> -c <storage_account_container_name> -x
+
 Changelog:
     2017-09-11 AutomationTeam:
     -initial script
+    2026-10-19 AutomationTeam:
+    -Extract archives straight from the download stream with -x, checking each range and member as it arrives
+    -Authenticate with a container SAS token reused across jobs until close to expiry instead of listing keys every run
+    -Share the SAS token and archive extraction helpers with install_packages_from_storage through storage_blob_helpers
 
 """
 import sys
@@ -29,7 +38,12 @@ import getopt
 import base64
 import automationassets
 import azure.mgmt.storage
+from azure.common import AzureHttpError
 from azure.storage.blob import BlockBlobService
+try:
+    import storage_blob_helpers
+except ImportError:
+    storage_blob_helpers = None
 
 def get_automation_runas_credential(runas_connection):
     """ Returns credentials to authenticate against Azure resoruce manager """
@@ -86,7 +100,8 @@ def download_blob(blob_file, local_path):
 
 # Process any arguments sent in
 (local_file_path, storage_account_name, storage_resource_group, storage_account_container_name, blob_name) = (None, None, None, None, None)
-opts, args = getopt.getopt(sys.argv[1:], "p:r:a:c:b:")
+extract_archives = False
+opts, args = getopt.getopt(sys.argv[1:], "p:r:a:c:b:x")
 for o, a in opts:
     if o == '-p':  # Local path to download files to.
         local_file_path = a
@@ -98,6 +113,8 @@ for o, a in opts:
         storage_account_container_name = a
     elif o == '-b':
         blob_name = a # Optional name of the blob
+    elif o == '-x':
+        extract_archives = True # Extract archives while they download
 
 # Check that required arguments are specified
 if (local_file_path is None
@@ -106,31 +123,52 @@ if (local_file_path is None
         or storage_account_container_name is None):
     raise ValueError("local direcotry, storage resource group, storage account, and container must be specified as arguments")
 
-# Authenticate to Azure resource manager
-automation_runas_connection = automationassets.get_automation_connection("AzureRunAsConnection")
-azure_credential = get_automation_runas_credential(automation_runas_connection)
-subscription_id = str(automation_runas_connection["SubscriptionId"])
-
-# Get storage key
-storage_client = azure.mgmt.storage.StorageManagementClient(
-    azure_credential,
-    subscription_id)
+if extract_archives and storage_blob_helpers is None:
+    raise ValueError("Extracting archives with -x requires the storage_blob_helpers runbook")
 
-storage_keys = storage_client.storage_accounts.list_keys(storage_resource_group, storage_account_name)
-storage_account_key = storage_keys.keys[0].value
+# Saved SAS tokens are only reused by jobs running as the same RunAs connection
+automation_runas_connection = automationassets.get_automation_connection("AzureRunAsConnection")
 
-# Authenticate to the storage account
-blobservice = BlockBlobService(account_name=storage_account_name, account_key=storage_account_key)
+def get_storage_client():
+    """ Authenticates to Azure resource manager, which is only needed when a storage key is listed """
+    azure_credential = get_automation_runas_credential(automation_runas_connection)
+    subscription_id = str(automation_runas_connection["SubscriptionId"])
+    return azure.mgmt.storage.StorageManagementClient(
+        azure_credential,
+        subscription_id)
+
+# Authenticate to the storage account, with a saved SAS token where storage_blob_helpers is available
+if storage_blob_helpers is not None:
+    storage_credentials = storage_blob_helpers.StorageCredentialProvider(get_storage_client, automation_runas_connection)
+    blobservice = storage_credentials.get_blob_service(storage_resource_group, storage_account_name, storage_account_container_name)
+else:
+    storage_keys = get_storage_client().storage_accounts.list_keys(storage_resource_group, storage_account_name)
+    blobservice = BlockBlobService(account_name=storage_account_name, account_key=storage_keys.keys[0].value)
 
 # If local directory does not exist, create it
 if not os.path.exists(local_file_path):
     os.makedirs(local_file_path)
 
-# If blob is specified, just download the blob, else download everything in the container
-if blob_name is not None:
-    blob = blobservice.get_blob_properties(storage_account_container_name, blob_name)
-else:
-    blobs = blobservice.list_blobs(storage_account_container_name)
-    # Dowload all blobs from the container and create local file system to match
-    for blob in blobs:
+def get_blobs(service):
+    """ Returns the properties of the blob passed in, or else the listing of the container """
+    if blob_name is not None:
+        return [service.get_blob_properties(storage_account_container_name, blob_name)]
+    return service.list_blobs(storage_account_container_name)
+
+# If blob is specified, just get that blob, else list everything in the container
+try:
+    blobs = get_blobs(blobservice)
+except AzureHttpError as e:
+    if e.status_code != 403 or storage_blob_helpers is None:
+        raise
+    # The saved token no longer works, most likely because the account keys were rotated
+    blobservice = storage_credentials.get_blob_service(storage_resource_group, storage_account_name,
+                                                       storage_account_container_name, renew=True)
+    blobs = get_blobs(blobservice)
+
+# Dowload the blobs and create local file system to match
+for blob in blobs:
+    if extract_archives and blob.name.lower().endswith(storage_blob_helpers.ARCHIVE_EXTENSIONS):
+        storage_blob_helpers.extract_blob(blobservice, storage_account_container_name, blob, local_file_path)
+    else:
         download_blob(blob, local_file_path)    
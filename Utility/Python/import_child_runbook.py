@@ -8,11 +8,167 @@ You could publish the below code as a new python runbook (hello_world) and then
 
 def hello(name):
     print name
+
+ChildRunbookImporter imports child runbooks straight from the automation account without writing them to disk.
+Their content is kept in memory with its ETag, so loading a runbook again only costs a conditional request.
+Call prefetch with every child runbook a parent needs to download them all concurrently before importing them.
+Where arm_read_cache is available it is mounted with its disk cache switched off, so nothing is written to disk either.
 """
+import imp
+import Queue
+import sys
+import threading
+
+import requests
+try:
+    import arm_read_cache
+except ImportError:
+    arm_read_cache = None
+
+# Number of runbooks to download at the same time when prefetching
+_MAX_THREADS = 10
+
+
+class ChildRunbookImporter(object):
+    """ Import hook that loads child runbooks from the automation account as modules of the same name """
+
+    def __init__(self, access_token, subscription_id, resource_group, automation_account):
+        self.account_uri = ("https://management.azure.com/subscriptions/" + subscription_id
+                            + "/resourceGroups/" + resource_group
+                            + "/providers/Microsoft.Automation/automationAccounts/" + automation_account)
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = 'Bearer ' + access_token
+        # Keep a connection open for every prefetch thread so they all reuse the same pool
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=_MAX_THREADS))
+        if arm_read_cache is not None:
+            # In memory only, runbooks are never written to disk
+            arm_read_cache.mount(self.session, arm_read_cache.ArmReadCache(
+                cache_dir=None, pool_connections=1, pool_maxsize=_MAX_THREADS))
+        self.runbooks = set()
+        # Runbook name -> (ETag, content) of the last version downloaded
+        self._cache = {}
+        # Runbooks prefetched but not imported yet, which don't need to be checked for changes again
+        self._prefetched = set()
+
+    def add(self, *runbook_names):
+        """ Makes the runbooks importable and installs the hook if it isn't already """
+        self.runbooks.update(runbook_names)
+        if self not in sys.meta_path:
+            sys.meta_path.append(self)
+
+    def prefetch(self, runbook_names):
+        """
+        Adds the runbooks and downloads them using at most _MAX_THREADS threads, so that importing them
+        afterwards needs no further requests. runbook_names is a list of names or a manifest with one per line
+        """
+        if isinstance(runbook_names, basestring):
+            runbook_names = parse_manifest(runbook_names)
+        self.add(*runbook_names)
+        name_queue = Queue.Queue()
+        for runbook_name in set(runbook_names):
+            name_queue.put(runbook_name)
+        errors = []
+
+        def worker():
+            while True:
+                try:
+                    runbook_name = name_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    self.get_source(runbook_name)
+                    self._prefetched.add(runbook_name)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(min(_MAX_THREADS, name_queue.qsize()))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def get_source(self, runbook_name):
+        """ Returns the content of a runbook, only downloading it again if it changed since it was cached """
+        uri = self.account_uri + "/runbooks/" + runbook_name + "/content?api-version=2015-10-31"
+        headers = {}
+        cached = self._cache.get(runbook_name)
+        if cached is not None and cached[0] is not None:
+            headers["If-None-Match"] = cached[0]
+        result = self.session.get(uri, headers=headers)
+        if result.status_code == 304:
+            return cached[1]
+        result.raise_for_status()
+        self._cache[runbook_name] = (result.headers.get("ETag"), result.text)
+        return result.text
+
+    def find_module(self, fullname, path=None):
+        """ PEP 302 finder: claims only the runbooks that were added """
+        return self if fullname in self.runbooks else None
+
+    def load_module(self, fullname):
+        """ PEP 302 loader: executes the runbook content in a new module """
+        if fullname in self._prefetched:
+            self._prefetched.discard(fullname)
+            source = self._cache[fullname][1]
+        else:
+            source = self.get_source(fullname)
+        module = sys.modules.setdefault(fullname, imp.new_module(fullname))
+        module.__file__ = "<runbook " + fullname + ">"
+        module.__loader__ = self
+        try:
+            exec compile(source, module.__file__, "exec") in module.__dict__
+        except:
+            del sys.modules[fullname]
+            raise
+        return module
+
+
+def parse_manifest(manifest):
+    """ Returns the runbook names in a manifest, one per line, ignoring blank lines and # comments """
+    names = []
+    for line in manifest.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            names.append(line)
+    return names
+
+
+def get_automation_runas_token(runas_connection):
+    """ Returs a token that can be used to authenticate against Azure resources """
+    from OpenSSL import crypto
+    import adal
+    import automationassets
+
+    # Get the Azure Automation RunAs service principal certificate
+    cert = automationassets.get_automation_certificate("AzureRunAsCertificate")
+    sp_cert = crypto.load_pkcs12(cert)
+    pem_pkey = crypto.dump_privatekey(crypto.FILETYPE_PEM, sp_cert.get_privatekey())
+
+    # Get run as connection information for the Azure Automation service principal
+    application_id = runas_connection["ApplicationId"]
+    thumbprint = runas_connection["CertificateThumbprint"]
+    tenant_id = runas_connection["TenantId"]
+
+    # Authenticate with service principal certificate
+    resource = "https://management.core.windows.net/"
+    authority_url = ("https://login.microsoftonline.com/" + tenant_id)
+    context = adal.AuthenticationContext(authority_url)
+    azure_credential = context.acquire_token_with_client_certificate(
+        resource,
+        application_id,
+        pem_pkey,
+        thumbprint)
+
+    # Return the token
+    return azure_credential.get('accessToken')
+
 
 def download_file(resource_group, automation_account, runbook_name, runbook_type):
     """
-    Downloads a runbook from the automation account to the cloud container
+    Downloads a runbook from the automation account to the cloud container.
+    Prefer ChildRunbookImporter, which imports runbooks without writing them to disk
 
     """
     import os
@@ -20,35 +176,6 @@ def download_file(resource_group, automation_account, runbook_name, runbook_type
     import requests
     import automationassets
 
-    # Return token based on Azure automation Runas connection
-    def get_automation_runas_token(runas_connection):
-        """ Returs a token that can be used to authenticate against Azure resources """
-        from OpenSSL import crypto
-        import adal
-
-        # Get the Azure Automation RunAs service principal certificate
-        cert = automationassets.get_automation_certificate("AzureRunAsCertificate")
-        sp_cert = crypto.load_pkcs12(cert)
-        pem_pkey = crypto.dump_privatekey(crypto.FILETYPE_PEM, sp_cert.get_privatekey())
-
-        # Get run as connection information for the Azure Automation service principal
-        application_id = runas_connection["ApplicationId"]
-        thumbprint = runas_connection["CertificateThumbprint"]
-        tenant_id = runas_connection["TenantId"]
-
-        # Authenticate with service principal certificate
-        resource = "https://management.core.windows.net/"
-        authority_url = ("https://login.microsoftonline.com/" + tenant_id)
-        context = adal.AuthenticationContext(authority_url)
-        azure_credential = context.acquire_token_with_client_certificate(
-            resource,
-            application_id,
-            pem_pkey,
-            thumbprint)
-
-        # Return the token
-        return azure_credential.get('accessToken')
-
     # Authenticate to Azure using the Azure Automation RunAs service principal
     automation_runas_connection = automationassets.get_automation_connection("AzureRunAsConnection")
     access_token = get_automation_runas_token(automation_runas_connection)
@@ -78,8 +205,17 @@ _AUTOMATION_ACCOUNT = "contosodev"
 _RUNBOOK_NAME = "hello_world"
 _RUNBOOK_TYPE = ".py"
 
-download_file(_AUTOMATION_RESOURCE_GROUP, _AUTOMATION_ACCOUNT, _RUNBOOK_NAME, _RUNBOOK_TYPE)
+if __name__ == '__main__':
+    # Authenticate to Azure using the Azure Automation RunAs service principal
+    import automationassets
+    automation_runas_connection = automationassets.get_automation_connection("AzureRunAsConnection")
+    access_token = get_automation_runas_token(automation_runas_connection)
+    subscription_id = str(automation_runas_connection["SubscriptionId"])
+
+    # Download the child runbooks together and make them importable straight from the automation account
+    importer = ChildRunbookImporter(access_token, subscription_id, _AUTOMATION_RESOURCE_GROUP, _AUTOMATION_ACCOUNT)
+    importer.prefetch([_RUNBOOK_NAME])
 
-# Import child runbook and call some function
-import child_runbook
-child_runbook.hello("world")
+    # Import child runbook and call some function
+    import hello_world
+    hello_world.hello("world")
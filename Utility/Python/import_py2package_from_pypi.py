@@ -10,29 +10,98 @@ Args:
     resource_group (-g) - Resource group name of the Automation account
     automation_account (-a) - Automation account name
     module_name (-m) - Name of module to import from pypi.org
+    wheelhouse (-w) - Optional wheelhouse to import from, either a local directory or a blob container url with a SAS token.
+                      Files it already has are used as pinned, others are synced into it from pypi.org first,
+                      so a container SAS token needs read and write permissions
+    wheelhouse_url (-u) - Url Automation downloads the wheelhouse from, used as the import contentLink. Required with -w.
+                          The base url a local directory is served from, or the container url with a read only SAS token
 
     Imports module
     Example:
         import_python2package_from_pypi.py -s xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxx -g contosogroup -a contosoaccount -m pytz
 
+    Imports module through a wheelhouse served from a web server
+    Example:
+        import_python2package_from_pypi.py -s xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxx -g contosogroup -a contosoaccount -m pytz -w c:\wheelhouse -u https://files.contoso.com/wheelhouse
+
+    Imports module through a wheelhouse in a storage container
+    Example:
+        import_python2package_from_pypi.py -s xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxx -g contosogroup -a contosoaccount -m pytz -w "https://contoso.blob.core.windows.net/wheelhouse?sv=...&sp=rw" -u "https://contoso.blob.core.windows.net/wheelhouse?sv=...&sp=r"
+
 Changelog:
     2018-09-22 AutomationTeam:
     -initial script
+    2026-10-19 AutomationTeam:
+    -Skip packages that are already imported into the Automation account with the same version
+    -Track the provisioning state of every submitted import and report how each one finished
+    -Import through a local or storage backed wheelhouse mirror
+    -Resolve dependencies in parallel from index metadata instead of downloading every package with pip
 
 """
 import requests
 import sys
-import pip
 import os
 import re
-import shutil
 import json
 import time
+import errno
 import getopt
+import shutil
+import hashlib
+import tempfile
+import tarfile
+import zipfile
+import threading
+import urllib
+import urlparse
+import Queue
+import email.parser
+import HTMLParser
+from StringIO import StringIO
+from pkg_resources import packaging
 
 #region Constants
 PYPI_ENDPOINT = "https://pypi.org/simple"
 FILENAME_PATTERN = "[\\w]+"
+SIMPLE_INDEX_JSON = "application/vnd.pypi.simple.v1+json"
+SIMPLE_INDEX_ACCEPT = SIMPLE_INDEX_JSON + ", text/html;q=0.01"
+SIMPLE_INDEX_LINK_REGEX = re.compile(r'<a\s([^>]*)>([^<]+)</a>', re.IGNORECASE)
+SIMPLE_INDEX_ATTRIBUTE_REGEX = re.compile(r'([\w-]+)\s*=\s*"([^"]*)"')
+# Max number of project pages and metadata files to fetch at a time
+_MAX_THREADS = 10
+# Wheel tags the Azure Automation Python 2.7 sandbox supports, most preferred first.
+# Source distributions are only picked when a version has no compatible wheel
+TARGET_TAGS = [('cp27', 'cp27m', 'win_amd64'), ('cp27', 'none', 'win_amd64'), ('py27', 'none', 'win_amd64'),
+               ('py2', 'none', 'win_amd64'), ('cp27', 'none', 'any'), ('py27', 'none', 'any'), ('py2', 'none', 'any')]
+SDIST_EXTENSIONS = ('.tar.gz', '.zip', '.tar.bz2')
+# Environment markers of the Azure Automation Python 2.7 sandbox
+TARGET_ENVIRONMENT = {
+    'implementation_name': 'cpython',
+    'implementation_version': '2.7.18',
+    'os_name': 'nt',
+    'platform_machine': 'AMD64',
+    'platform_python_implementation': 'CPython',
+    'platform_release': '',
+    'platform_system': 'Windows',
+    'platform_version': '',
+    'python_full_version': '2.7.18',
+    'python_version': '2.7',
+    'sys_platform': 'win32'
+}
+# Submitted imports are polled starting at this interval, backing off up to the max interval
+IMPORT_POLL_INITIAL_SECONDS = 5
+IMPORT_POLL_MAX_SECONDS = 30
+IMPORT_POLL_BACKOFF = 1.5
+# Stop waiting for imports that have not settled after this many seconds
+IMPORT_TIMEOUT_SECONDS = 3600
+IMPORT_TERMINAL_STATES = ('Succeeded', 'Failed', 'Cancelled')
+# Name of the precomputed index of a wheelhouse, stored at its root
+WHEELHOUSE_INDEX = "index.json"
+BLOB_API_VERSION = "2019-12-12"
+# Times the wheelhouse index is merged and written again when another job changed it in the meantime
+WHEELHOUSE_INDEX_RETRIES = 5
+# Seconds after which the lock file another job left on a local wheelhouse index is considered abandoned
+WHEELHOUSE_LOCK_SECONDS = 60
 #endregion
 
 def get_automation_runas_token():
@@ -65,16 +134,475 @@ def get_automation_runas_token():
     # Return the token
     return azure_credential.get('accessToken')
 
-def get_packagename_from_filename(packagefilename):
-    match = re.match(FILENAME_PATTERN, packagefilename)
-    return match.group(0)
+def get_version_from_filename(packagefilename):
+    """ Returns the version part of a wheel or source distribution file name """
+    if packagefilename.endswith('.whl'):
+        return packagefilename.split('-')[1]
+    basename = re.sub(r'\.(tar\.gz|tar\.bz2|zip)$', '', packagefilename)
+    return basename.rsplit('-', 1)[-1]
+
+def normalize_package_name(packagename):
+    """ Returns the normalized form of a package name so spellings like Foo_Bar and foo-bar match """
+    return re.sub(r"[-_.]+", "-", packagename).lower()
+
+def get_imported_packages():
+    """ Returns a map of normalized package name to the python 2 package resources already in the Automation account """
+    request_url = "https://management.azure.com/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Automation/automationAccounts/%s/python2Packages?api-version=2018-06-30" \
+                  % (subscription_id, resource_group, automation_account)
+    headers = {'Content-Type' : 'application/json', 'Authorization' : "Bearer %s" % token}
+    packages = {}
+    while request_url:
+        r = requests.get(request_url, headers=headers)
+        if str(r.status_code) != "200":
+            raise Exception("Error listing packages in Automation account. Error code is {0}".format(str(r.status_code)))
+        page = r.json()
+        for package in page.get('value', []):
+            packages[normalize_package_name(package['name'])] = package
+        request_url = page.get('nextLink')
+    return packages
+
+def is_package_imported(imported_packages, packagename, version):
+    """ Returns whether a package is already imported successfully with this version """
+    package = imported_packages.get(normalize_package_name(packagename))
+    if package is None:
+        return False
+    properties = package.get('properties') or {}
+    return properties.get('provisioningState') == 'Succeeded' and properties.get('version') == version
+
+# Shared by all index requests so connections are reused across threads
+session = requests.Session()
+_project_files = {}
+_project_lock = threading.Lock()
+# Wheelhouse files are preferred to the index when one is given with -w
+wheelhouse = None
+
+def get_file_rank(packagefilename):
+    """ Returns the rank of a file for the target sandbox, lower is better, or None if it can't be used """
+    if packagefilename.endswith('.whl'):
+        python_tags, abi_tags, platform_tags = [tag.split('.') for tag in packagefilename[:-len('.whl')].split('-')[-3:]]
+        ranks = [rank for rank, (python_tag, abi_tag, platform_tag) in enumerate(TARGET_TAGS)
+                 if python_tag in python_tags and abi_tag in abi_tags and platform_tag in platform_tags]
+        return min(ranks) if ranks else None
+    if packagefilename.endswith(SDIST_EXTENSIONS):
+        return len(TARGET_TAGS)
+    return None
+
+def parse_simple_index(response):
+    """ Returns the file entries of a project page in the shape of the PEP 691 JSON format, from either JSON or HTML """
+    if response.headers.get('Content-Type', '').startswith(SIMPLE_INDEX_JSON):
+        return response.json()['files']
+    unescape = HTMLParser.HTMLParser().unescape
+    entries = []
+    for attributes, name in SIMPLE_INDEX_LINK_REGEX.findall(response.text):
+        attributes = dict(SIMPLE_INDEX_ATTRIBUTE_REGEX.findall(attributes))
+        if 'href' not in attributes:
+            continue
+        url, _, fragment = unescape(attributes['href']).partition('#')
+        entries.append({
+            'filename': unescape(name).strip(),
+            'url': url,
+            'hashes': dict([fragment.split('=', 1)]) if '=' in fragment else {},
+            'requires-python': unescape(attributes.get('data-requires-python', '')) or None,
+            'core-metadata': attributes.get('data-core-metadata', attributes.get('data-dist-info-metadata', 'false')) != 'false',
+            'yanked': 'data-yanked' in attributes
+        })
+    return entries
+
+def get_project_files(packagename):
+    """ Returns the usable files of a project from the JSON simple index, fetching each project once """
+    project = normalize_package_name(packagename)
+    with _project_lock:
+        if project in _project_files:
+            return _project_files[project]
+    response = session.get("%s/%s/" % (PYPI_ENDPOINT, project), headers={'Accept': SIMPLE_INDEX_ACCEPT})
+    if response.status_code != 200:
+        raise Exception("Error reading project {0} from {1}. Error code is {2}".format(project, PYPI_ENDPOINT, str(response.status_code)))
+    files = []
+    for entry in parse_simple_index(response):
+        rank = get_file_rank(entry['filename'])
+        if rank is None or entry.get('yanked'):
+            continue
+        requires_python = entry.get('requires-python')
+        try:
+            if requires_python and not packaging.specifiers.SpecifierSet(requires_python).contains(TARGET_ENVIRONMENT['python_full_version']):
+                continue
+        except packaging.specifiers.InvalidSpecifier:
+            pass
+        files.append({
+            'filename': entry['filename'],
+            'url': urlparse.urljoin(response.url, entry['url']),
+            'version': packaging.version.parse(get_version_from_filename(entry['filename'])),
+            'rank': rank,
+            'has_metadata': bool(entry.get('core-metadata', entry.get('data-dist-info-metadata'))),
+            'sha256': (entry.get('hashes') or {}).get('sha256')
+        })
+    with _project_lock:
+        return _project_files.setdefault(project, files)
+
+def select_best_file(package_files, specifier):
+    """ Returns the best ranked file of the newest version allowed by a specifier, in a single pass, or None """
+    best = None
+    for package_file in package_files:
+        if not specifier.contains(package_file['version']):
+            continue
+        if (best is None or package_file['version'] > best['version']
+                or (package_file['version'] == best['version'] and package_file['rank'] < best['rank'])):
+            best = package_file
+    return best
+
+def select_file(packagename, specifier):
+    """ Returns the file to use for a package, the wheelhouse's when it has one allowed by the specifier """
+    best = None
+    if wheelhouse is not None:
+        best = select_best_file(wheelhouse.get_files(packagename), specifier)
+    if best is None:
+        best = select_best_file(get_project_files(packagename), specifier)
+    if best is None:
+        raise Exception("No compatible file of {0} satisfies {1}".format(packagename, specifier or "any version"))
+    return best
+
+def read_requires_txt(content):
+    """ Converts the egg-info requires.txt of a source distribution into Requires-Dist style lines """
+    lines = []
+    section_marker = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('['):
+            extra, _, marker = line[1:-1].partition(':')
+            markers = ([marker] if marker else []) + (["extra == '%s'" % extra] if extra else [])
+            section_marker = " and ".join("(%s)" % marker for marker in markers) or None
+            continue
+        lines.append("%s; %s" % (line, section_marker) if section_marker else line)
+    return lines
+
+def get_requires_dist(package_file):
+    """ Returns the Requires-Dist lines of a file, reading only its metadata whenever the index has it """
+    if 'path' in package_file:
+        return wheelhouse.get_requires_dist(package_file)
+    if package_file['has_metadata']:
+        response = session.get(package_file['url'].split('#')[0] + ".metadata")
+        if response.status_code != 200:
+            raise Exception("Error reading metadata of {0}. Error code is {1}".format(package_file['filename'], str(response.status_code)))
+        return email.parser.Parser().parsestr(response.content, headersonly=True).get_all('Requires-Dist') or []
+    # No metadata file, so read the requirements out of the archive in memory
+    response = session.get(package_file['url'].split('#')[0])
+    if response.status_code != 200:
+        raise Exception("Error reading {0}. Error code is {1}".format(package_file['filename'], str(response.status_code)))
+    archive = StringIO(response.content)
+    if package_file['filename'].endswith('.whl'):
+        wheel = zipfile.ZipFile(archive)
+        metadata = wheel.read([name for name in wheel.namelist() if re.match(r'^[^/]+\.dist-info/METADATA$', name)][0])
+        return email.parser.Parser().parsestr(metadata, headersonly=True).get_all('Requires-Dist') or []
+    if package_file['filename'].endswith('.zip'):
+        sdist = zipfile.ZipFile(archive)
+        names = [name for name in sdist.namelist() if name.endswith('.egg-info/requires.txt')]
+        return read_requires_txt(sdist.read(min(names, key=len))) if names else []
+    sdist = tarfile.open(fileobj=archive)
+    names = [name for name in sdist.getnames() if name.endswith('.egg-info/requires.txt')]
+    return read_requires_txt(sdist.extractfile(min(names, key=len)).read()) if names else []
+
+def get_requirements(package_file, extras):
+    """ Returns the requirements of a file that apply to the target sandbox with the given extras """
+    requirements = []
+    for line in get_requires_dist(package_file):
+        requirement = packaging.requirements.Requirement(line)
+        if requirement.marker is not None and not any(
+                requirement.marker.evaluate(dict(TARGET_ENVIRONMENT, extra=extra)) for extra in [''] + list(extras)):
+            continue
+        requirements.append(requirement)
+    return requirements
+
+def parallel_map(function, items):
+    """ Calls function for every item using at most _MAX_THREADS threads, returning the results in order """
+    item_queue = Queue.Queue()
+    for index, item in enumerate(items):
+        item_queue.put((index, item))
+    results = [None] * len(items)
+    errors = []
+
+    def worker():
+        while True:
+            try:
+                index, item = item_queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = function(item)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(_MAX_THREADS, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+def _resolve_requirement(item):
+    packagename, specifier, package_file, extras = item
+    if package_file is None:
+        package_file = select_file(packagename, specifier)
+    return package_file, get_requirements(package_file, extras)
+
+def resolve_dependencies(packagename):
+    """
+    Returns a list of (package name, file) for a package and all of its dependencies, resolving each level
+    of the tree in parallel. Only index pages and metadata are downloaded. Every requirement of a package
+    narrows the versions it may have; when the file already picked no longer satisfies them all, the newest
+    one that does is picked instead, or resolution fails if there is none.
+    """
+    names = {}
+    order = []
+    specifiers = {}
+    # Normalized name to the (file, extras, requirements) picked for it
+    resolved = {}
+    pending = [packaging.requirements.Requirement(packagename)]
+    while pending:
+        # Merge the specifiers and extras of every requirement of a package in this level of the tree
+        level = {}
+        level_order = []
+        for requirement in pending:
+            key = normalize_package_name(requirement.name)
+            if key not in names:
+                names[key] = requirement.name
+                order.append(key)
+            specifiers[key] = specifiers.get(key, packaging.specifiers.SpecifierSet()) & requirement.specifier
+            if key not in level:
+                level[key] = set()
+                level_order.append(key)
+            level[key].update(requirement.extras)
+        # Then fetch every new or re-picked project of the level at once
+        work = []
+        for key in level_order:
+            package_file, resolved_extras = resolved[key][:2] if key in resolved else (None, set())
+            if package_file is not None and not specifiers[key].contains(package_file['version'], prereleases=True):
+                print "%s %s does not satisfy %s, picking another version" % (names[key], package_file['version'], specifiers[key])
+                package_file = None
+            elif package_file is not None and level[key] <= resolved_extras:
+                continue
+            work.append((key, (names[key], specifiers[key], package_file, level[key] | resolved_extras)))
+        pending = []
+        for (key, item), (package_file, requirements) in zip(work, parallel_map(_resolve_requirement, [item for key, item in work])):
+            print "Resolved %s%s to %s" % (names[key], specifiers[key], package_file['filename'])
+            resolved[key] = (package_file, item[3], requirements)
+            pending.extend(requirements)
+    # A re-picked version may no longer need the dependencies of the version it replaced
+    needed = set()
+    keys = [normalize_package_name(packagename)]
+    while keys:
+        key = keys.pop()
+        if key not in needed:
+            needed.add(key)
+            keys.extend(normalize_package_name(requirement.name) for requirement in resolved[key][2])
+    return [(names[key], resolved[key][0]) for key in order if key in needed]
 
-def resolve_download_url(packagename, packagefilename):
-    response = requests.get("%s/%s" % (PYPI_ENDPOINT, packagename))
-    download_uri_regex = "<a href=\"([^\"]+)\".*>%s<" % packagefilename
-    download_uri_match = re.search(download_uri_regex, response.content)
-    print "detected download uri %s for %s" % (download_uri_match.group(1), packagename)
-    return download_uri_match.group(1)
+def make_dirs(path):
+    """ Creates a directory and its parents, allowing another thread or job to create it at the same time """
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+class LocalWheelhouseStore(object):
+    """ Keeps wheelhouse files in a local directory, served to Automation from a base url """
+    def __init__(self, path, base_url):
+        self.path = path
+        self.base_url = base_url
+
+    def read(self, name):
+        return self.read_versioned(name)[0]
+
+    def read_versioned(self, name):
+        """ Returns the content of a file and the version to write it back with, or None for both if it doesn't exist """
+        try:
+            with open(os.path.join(self.path, name), "rb") as wheelhouse_file:
+                content = wheelhouse_file.read()
+        except IOError:
+            return None, None
+        return content, hashlib.sha1(content).hexdigest()
+
+    def write(self, name, source_file):
+        target_path = os.path.join(self.path, name)
+        make_dirs(os.path.dirname(target_path))
+        temp_fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(target_path))
+        with os.fdopen(temp_fd, "wb") as target_file:
+            shutil.copyfileobj(source_file, target_file)
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        os.rename(temp_path, target_path)
+
+    def write_if_unchanged(self, name, source_file, version):
+        """ Writes a file unless another job changed it since it was read at version, returning whether it was written """
+        lock_path = os.path.join(self.path, name + ".lock")
+        make_dirs(os.path.dirname(lock_path))
+        while True:
+            try:
+                lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            try:
+                if time.time() - os.path.getmtime(lock_path) > WHEELHOUSE_LOCK_SECONDS:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            time.sleep(0.1)
+        try:
+            if self.read_versioned(name)[1] != version:
+                return False
+            self.write(name, source_file)
+            return True
+        finally:
+            os.close(lock_fd)
+            os.remove(lock_path)
+
+    def url_for(self, name):
+        return "%s/%s" % (self.base_url.rstrip('/'), urllib.quote(name))
+
+class BlobWheelhouseStore(object):
+    """
+    Keeps wheelhouse files in a blob container, authorized by the SAS token in the container url.
+    Automation is given urls signed with the read only SAS token of read_url, so the other one isn't stored with the packages
+    """
+    def __init__(self, container_url, read_url):
+        parts = urlparse.urlsplit(container_url)
+        self.base_url = urlparse.urlunsplit((parts.scheme, parts.netloc, parts.path.rstrip('/'), '', ''))
+        self.sas = parts.query
+        self.read_sas = urlparse.urlsplit(read_url).query
+
+    def _blob_url(self, name):
+        return "%s/%s?%s" % (self.base_url, urllib.quote(name), self.sas)
+
+    def read(self, name):
+        return self.read_versioned(name)[0]
+
+    def read_versioned(self, name):
+        """ Returns the content of a blob and its ETag, or None for both if it doesn't exist """
+        response = session.get(self._blob_url(name), headers={'x-ms-version': BLOB_API_VERSION})
+        if response.status_code == 404:
+            return None, None
+        if response.status_code != 200:
+            raise Exception("Error reading {0} from wheelhouse. Error code is {1}".format(name, str(response.status_code)))
+        return response.content, response.headers.get('ETag')
+
+    def _put(self, name, source_file, headers):
+        headers = dict(headers, **{'x-ms-version': BLOB_API_VERSION, 'x-ms-blob-type': 'BlockBlob'})
+        return session.put(self._blob_url(name), data=source_file, headers=headers)
+
+    def write(self, name, source_file):
+        response = self._put(name, source_file, {})
+        if response.status_code != 201:
+            raise Exception("Error writing {0} to wheelhouse. Error code is {1}".format(name, str(response.status_code)))
+
+    def write_if_unchanged(self, name, source_file, version):
+        """ Writes a blob unless another job changed it since it was read with the ETag version, returning whether it was written """
+        response = self._put(name, source_file, {'If-Match': version} if version is not None else {'If-None-Match': '*'})
+        if response.status_code in (409, 412):
+            return False
+        if response.status_code != 201:
+            raise Exception("Error writing {0} to wheelhouse. Error code is {1}".format(name, str(response.status_code)))
+        return True
+
+    def url_for(self, name):
+        return "%s/%s?%s" % (self.base_url, urllib.quote(name), self.read_sas)
+
+class Wheelhouse(object):
+    """
+    A pinned mirror of the files this runbook imports, with a precomputed index read in a single request.
+    Files it has are used instead of the ones on the index, and anything missing is copied into it before importing
+    """
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._files = {}
+        self._added = []
+        content = store.read(WHEELHOUSE_INDEX)
+        index = json.loads(content) if content else {'projects': {}}
+        for project, entries in index['projects'].items():
+            self._files[project] = [self._to_file(entry) for entry in entries]
+
+    def _to_file(self, entry):
+        return {
+            'filename': entry['filename'],
+            'url': self.store.url_for(entry['path']),
+            'path': entry['path'],
+            'version': packaging.version.parse(get_version_from_filename(entry['filename'])),
+            'rank': get_file_rank(entry['filename']),
+            'has_metadata': True,
+            'sha256': entry.get('sha256')
+        }
+
+    def get_files(self, packagename):
+        """ Returns the usable wheelhouse files of a package """
+        return [package_file for package_file in self._files.get(normalize_package_name(packagename), [])
+                if package_file['rank'] is not None]
+
+    def get_requires_dist(self, package_file):
+        """ Returns the Requires-Dist lines saved with a wheelhouse file """
+        content = self.store.read(package_file['path'] + ".metadata")
+        if content is None:
+            raise Exception("Metadata of {0} is missing from the wheelhouse".format(package_file['filename']))
+        return email.parser.Parser().parsestr(content, headersonly=True).get_all('Requires-Dist') or []
+
+    def _sync_file(self, dependency):
+        """ Copies a file from the index into the wheelhouse with its requirements, verifying its sha256 when known """
+        packagename, package_file = dependency
+        project = normalize_package_name(packagename)
+        path = "%s/%s" % (project, package_file['filename'])
+        wheel_file = tempfile.TemporaryFile()
+        try:
+            digest = hashlib.sha256()
+            response = session.get(package_file['url'].split('#')[0], stream=True)
+            if response.status_code != 200:
+                raise Exception("Error downloading {0}. Error code is {1}".format(package_file['filename'], str(response.status_code)))
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                digest.update(chunk)
+                wheel_file.write(chunk)
+            if package_file['sha256'] and package_file['sha256'] != digest.hexdigest():
+                raise Exception("Hash mismatch downloading {0}".format(package_file['filename']))
+            wheel_file.seek(0)
+            self.store.write(path, wheel_file)
+        finally:
+            wheel_file.close()
+        # Source distributions have no metadata file, so the requirements read from them are saved in the same format
+        metadata = "Metadata-Version: 2.1\nName: %s\nVersion: %s\n" % (packagename, package_file['version'])
+        metadata += "".join("Requires-Dist: %s\n" % line for line in get_requires_dist(package_file))
+        self.store.write(path + ".metadata", StringIO(metadata))
+        entry = {'filename': package_file['filename'], 'path': path, 'sha256': digest.hexdigest()}
+        with self._lock:
+            self._added.append((project, entry))
+            self._files.setdefault(project, []).append(self._to_file(entry))
+        print "Synced %s into wheelhouse" % package_file['filename']
+        return self._to_file(entry)
+
+    def save_index(self):
+        """ Merges the files this run added into the latest index and writes it, again if another job wrote it first """
+        for attempt in range(WHEELHOUSE_INDEX_RETRIES):
+            content, version = self.store.read_versioned(WHEELHOUSE_INDEX)
+            index = json.loads(content) if content else {'projects': {}}
+            for project, entry in self._added:
+                entries = index['projects'].setdefault(project, [])
+                if entry['filename'] not in [existing['filename'] for existing in entries]:
+                    entries.append(entry)
+            if self.store.write_if_unchanged(WHEELHOUSE_INDEX, StringIO(json.dumps(index, indent=1, sort_keys=True)), version):
+                return
+        raise Exception("Error saving the wheelhouse index, other jobs kept changing it")
+
+    def sync(self, dependencies):
+        """ Copies the files of dependencies that the wheelhouse doesn't have and returns them with the wheelhouse files """
+        missing = [(pkgname, package_file) for pkgname, package_file in dependencies if 'path' not in package_file]
+        if not missing:
+            return dependencies
+        synced = dict((package_file['filename'], synced_file) for (pkgname, package_file), synced_file
+                      in zip(missing, parallel_map(self._sync_file, missing)))
+        self.save_index()
+        return [(pkgname, synced.get(package_file['filename'], package_file)) for pkgname, package_file in dependencies]
 
 def send_webservice_import_module_request(packagename, download_uri_for_file):
     request_url = "https://management.azure.com/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Automation/automationAccounts/%s/python2Packages/%s?api-version=2018-06-30" \
@@ -87,23 +615,58 @@ def send_webservice_import_module_request(packagename, download_uri_for_file):
     if str(r.status_code) not in ["200", "201"]:
         raise Exception("Error importing package {0} into Automation account. Error code is {1}".format(packagename, str(r.status_code)))
 
-def make_temp_dir():
-    destdir = os.path._getfullpathname("tempDownloadDir")
-    if os.path.exists(destdir):
-        shutil.rmtree(destdir)
-    os.makedirs(destdir, 0o755)
-    return destdir
+def wait_for_imports(submitted):
+    """ Polls the account's package list until every submitted import settles. Returns the names that failed """
+    pending = dict((normalize_package_name(name), (name, submitted_at)) for name, submitted_at in submitted)
+    failed = []
+    started = time.time()
+    delay = IMPORT_POLL_INITIAL_SECONDS
+    while pending and time.time() - started < IMPORT_TIMEOUT_SECONDS:
+        time.sleep(delay)
+        # One listing of the account covers every package still being imported
+        imported_packages = get_imported_packages()
+        for key, (name, submitted_at) in pending.items():
+            properties = (imported_packages.get(key) or {}).get('properties') or {}
+            state = properties.get('provisioningState')
+            if state not in IMPORT_TERMINAL_STATES:
+                continue
+            del pending[key]
+            if state == 'Succeeded':
+                print "Package %s imported in %d seconds" % (name, time.time() - submitted_at)
+            else:
+                error = properties.get('error') or {}
+                print "Package %s %s after %d seconds: %s" % (name, state.lower(), time.time() - submitted_at, error.get('message') or error.get('code'))
+                failed.append(name)
+        delay = min(delay * IMPORT_POLL_BACKOFF, IMPORT_POLL_MAX_SECONDS)
+    for name, submitted_at in pending.values():
+        print "Package %s did not finish importing in %d seconds" % (name, IMPORT_TIMEOUT_SECONDS)
+        failed.append(name)
+    return failed
 
 def import_package_with_dependencies (packagename):
-    # download package with all depeendencies
-    download_dir = make_temp_dir()
-    pip.main(['download', '-d', download_dir, packagename])
-    for file in os.listdir(download_dir):
-        pkgname = get_packagename_from_filename(file)
-        download_uri_for_file = resolve_download_url(pkgname, file)
+    # resolve package with all dependencies from the index metadata, without downloading the packages
+    dependencies = resolve_dependencies(packagename)
+    if wheelhouse is not None:
+        # Mirror anything new so the imports and later runs are served from the wheelhouse
+        dependencies = wheelhouse.sync(dependencies)
+    # List the account's packages once so only missing or changed versions are imported
+    imported_packages = get_imported_packages()
+    missing = []
+    for pkgname, package_file in dependencies:
+        if is_package_imported(imported_packages, pkgname, str(package_file['version'])):
+            print "Package %s %s is already imported, skipping" % (pkgname, package_file['version'])
+        else:
+            missing.append((pkgname, package_file))
+    dependencies = missing
+    submitted = []
+    for pkgname, package_file in dependencies:
+        download_uri_for_file = package_file['url']
+        print "detected download uri %s for %s" % (download_uri_for_file, pkgname)
         send_webservice_import_module_request(pkgname, download_uri_for_file)
+        submitted.append((pkgname, time.time()))
         # Sleep a few seconds so we don't send too many import requests https://docs.microsoft.com/en-us/azure/azure-subscription-service-limits#automation-limits
         time.sleep(10)
+    return submitted
 
 if __name__ == '__main__':
     if len(sys.argv) < 9:
@@ -115,8 +678,10 @@ if __name__ == '__main__':
     resource_group = None
     automation_account = None
     module_name = None
+    wheelhouse_location = None
+    wheelhouse_url = None
 
-    opts, args = getopt.getopt(sys.argv[1:], "s:g:a:m:")
+    opts, args = getopt.getopt(sys.argv[1:], "s:g:a:m:w:u:")
     for o, i in opts:
         if o == '-s':  
             subscription_id = i
@@ -126,10 +691,27 @@ if __name__ == '__main__':
             automation_account = i
         elif o == '-m': 
             module_name = i
+        elif o == '-w':
+            wheelhouse_location = i
+        elif o == '-u':
+            wheelhouse_url = i
+
+    if wheelhouse_location is not None:
+        if wheelhouse_url is None:
+            raise ValueError("A wheelhouse url -u must be specified with a wheelhouse -w so Automation can download the packages")
+        if wheelhouse_location.startswith("https://"):
+            wheelhouse = Wheelhouse(BlobWheelhouseStore(wheelhouse_location, wheelhouse_url))
+        else:
+            wheelhouse = Wheelhouse(LocalWheelhouseStore(wheelhouse_location, wheelhouse_url))
 
     # Set Run as token for this automation accounts service principal to be used to import the package into Automation account
     token = get_automation_runas_token()
 
     # Import package with dependencies from pypi.org
-    import_package_with_dependencies(module_name)
-    print "\nCheck the python 2 packages page for import status..."
+    submitted = import_package_with_dependencies(module_name)
+
+    # Wait for the imports to finish in the Automation account and report any that failed
+    failed = wait_for_imports(submitted)
+    print "\nImported %d of %d packages" % (len(submitted) - len(failed), len(submitted))
+    if failed:
+        raise Exception("Error importing packages {0} into Automation account".format(", ".join(failed)))
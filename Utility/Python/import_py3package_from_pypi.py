@@ -9,109 +9,840 @@ Args:
     automation_account (-a) - Automation account name
     module_name (-m) - Name of module to import from pypi.org
     version (-v) - Version of module to be imported.
+    index_url (-i) - Optional simple index to resolve packages from. Defaults to https://pypi.org/simple
+    wheelhouse (-w) - Optional wheelhouse to import from, either a local directory or a blob container url with a SAS token.
+                      Wheels it already has are used as pinned, others are synced into it from the index first,
+                      so a container SAS token needs read, write and list permissions
+    wheelhouse_url (-u) - Url Automation downloads the wheelhouse from, used as the import contentLink. Required with -w.
+                          The base url a local directory is served from, or the container url with a read only SAS token
     Imports module
     Example:
         import_python3package_from_pypi.py -s xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxx -g contosogroup -a contosoaccount -m pytz -v 1.0.0
+    Imports module through a wheelhouse in a storage container
+    Example:
+        import_python3package_from_pypi.py -s xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxx -g contosogroup -a contosoaccount -m pytz -v 1.0.0 -w "https://contoso.blob.core.windows.net/wheelhouse?sv=...&sp=rwl" -u "https://contoso.blob.core.windows.net/wheelhouse?sv=...&sp=r"
 Changelog:
     2020-12-29 AutomationTeam:
     -Import Python 3 package with dependencies
+    2026-10-19 AutomationTeam:
+    -Acquire the managed identity token lazily and refresh it before it expires
+    -Submit dependency imports concurrently, rate limited to the account import limits
+    -Parse and cache pypi.org project pages once instead of rescanning them for each lookup
+    -Resolve dependencies from the JSON simple API and wheel metadata files instead of installing them
+    -Skip packages that are already imported into the Automation account with the same version
+    -Track the provisioning state of every submitted import and report how each one finished
+    -Pick wheels in one pass by ranking their compatibility tags against the target interpreter
+    -Import through a local or storage backed wheelhouse mirror
+    -Send ARM requests through arm_read_cache where it is available, so the package listing is shared between jobs
 """
 import requests
-import subprocess
 import json
 import sys
-import pip
 import os
 import re
-import shutil
-import json
 import time
 import getopt
-import re
+import threading
+import tempfile
+import collections
+import html
+import urllib.parse
+import io
+import zipfile
+import email.parser
+import functools
+import hashlib
+import shutil
+import concurrent.futures
 from pkg_resources import packaging
+try:
+    import arm_read_cache
+except ImportError:
+    arm_read_cache = None
 
 #region Constants
 PYPI_ENDPOINT = "https://pypi.org/simple"
 FILENAME_PATTERN = "[\\w]+"
+# Project pages are cached here with their ETag so later runs only revalidate them
+PYPI_CACHE_DIR = os.path.join(tempfile.gettempdir(), "pypi_simple_cache")
+SIMPLE_INDEX_JSON = "application/vnd.pypi.simple.v1+json"
+SIMPLE_INDEX_ACCEPT = SIMPLE_INDEX_JSON + ", text/html;q=0.01"
+SIMPLE_INDEX_LINK_REGEX = re.compile(r'<a\s([^>]*)>([^<]+)</a>', re.IGNORECASE)
+SIMPLE_INDEX_ATTRIBUTE_REGEX = re.compile(r'([\w-]+)\s*=\s*"([^"]*)"')
+WHEEL_FILENAME_REGEX = re.compile(
+    r'^(?P<name>[^-]+)-(?P<version>[^-]+)(-\d[^-]*)?-(?P<tags>[^-]+-[^-]+-[^-]+)\.whl$')
+SDIST_FILENAME_REGEX = re.compile(r'^(?P<name>.+)-(?P<version>[^-]+)\.(tar\.gz|zip|tar\.bz2)$')
+ARM_RESOURCE = "https://management.core.windows.net"
+# Refresh the managed identity token this many seconds before it actually expires
+TOKEN_REFRESH_SKEW_SECONDS = 300
+# Automation accepts at most 5 module imports every 30 seconds per account
+# https://docs.microsoft.com/en-us/azure/azure-subscription-service-limits#automation-limits
+IMPORT_RATE_LIMIT = 5
+IMPORT_RATE_PERIOD_SECONDS = 30
+# Max number of packages to resolve and submit at a time
+MAX_IMPORT_WORKERS = 5
+# Max number of project pages and metadata files to fetch at a time while resolving dependencies
+MAX_RESOLVE_WORKERS = 10
+# Name of the precomputed index of a wheelhouse, stored at its root
+WHEELHOUSE_INDEX = "index.json"
+BLOB_API_VERSION = "2019-12-12"
+# Times the wheelhouse index is merged and written again when another job changed it in the meantime
+WHEELHOUSE_INDEX_RETRIES = 5
+# Seconds after which the lock file another job left on a local wheelhouse index is considered abandoned
+WHEELHOUSE_LOCK_SECONDS = 60
+# Interpreter and platforms of the Azure Automation sandbox the packages are imported for.
+# Wheels are ranked against the tags they support, most specific first
+TARGET_PYTHON_VERSION = (3, 8)
+TARGET_PLATFORMS = ('win_amd64',)
+# Environment markers of the Azure Automation Python 3.8 sandbox the packages are imported for
+TARGET_ENVIRONMENT = {
+    'implementation_name': 'cpython',
+    'implementation_version': '3.8.0',
+    'os_name': 'nt',
+    'platform_machine': 'AMD64',
+    'platform_python_implementation': 'CPython',
+    'platform_release': '',
+    'platform_system': 'Windows',
+    'platform_version': '',
+    'python_full_version': '3.8.0',
+    'python_version': '3.8',
+    'sys_platform': 'win32'
+}
+# Number of times a throttled (429) import request is retried
+MAX_IMPORT_RETRIES = 5
+# Submitted imports are polled starting at this interval, backing off up to the max interval
+IMPORT_POLL_INITIAL_SECONDS = 5
+IMPORT_POLL_MAX_SECONDS = 30
+IMPORT_POLL_BACKOFF = 1.5
+# Stop waiting for imports that have not settled after this many seconds
+IMPORT_TIMEOUT_SECONDS = 3600
+IMPORT_TERMINAL_STATES = ('Succeeded', 'Failed', 'Cancelled')
 #endregion
 
-# collecting acces_token using MSI
-endPoint = os.getenv('IDENTITY_ENDPOINT')+"?resource=https://management.core.windows.net" 
-identityHeader = os.getenv('IDENTITY_HEADER') 
-payload={} 
-headers = { 
-  'X-IDENTITY-HEADER': identityHeader,
-  'Metadata': 'True' 
-}
-response = requests.request("GET", endPoint, headers=headers, data=payload) 
-response = json.loads(response.text)
-token = response['access_token']
+class ManagedIdentityCredential(object):
+    """ Lazily acquires and caches a managed identity token, refreshing it before it expires """
+    def __init__(self, resource=ARM_RESOURCE):
+        self.resource = resource
+        self._token = None
+        self._expires_on = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        # collecting acces_token using MSI
+        endPoint = os.getenv('IDENTITY_ENDPOINT') + "?resource=" + self.resource
+        headers = {
+            'X-IDENTITY-HEADER': os.getenv('IDENTITY_HEADER'),
+            'Metadata': 'True'
+        }
+        response = requests.request("GET", endPoint, headers=headers)
+        if response.status_code != 200:
+            raise Exception("Error acquiring managed identity token. Error code is {0}".format(str(response.status_code)))
+        response = json.loads(response.text)
+        self._token = response['access_token']
+        if 'expires_on' in response:
+            self._expires_on = float(response['expires_on'])
+        else:
+            self._expires_on = time.time() + float(response.get('expires_in', 3600))
+
+    def get_token(self, force_refresh=False):
+        """ Returns a valid access token, acquiring a new one on first use or when close to expiry """
+        with self._lock:
+            if force_refresh or self._token is None or time.time() >= self._expires_on - TOKEN_REFRESH_SKEW_SECONDS:
+                self._acquire()
+            return self._token
+
+    def invalidate(self):
+        """ Drops the cached token so the next call to get_token acquires a new one """
+        with self._lock:
+            self._token = None
+            self._expires_on = 0
+
+class RateLimiter(object):
+    """ Blocks callers so no more than rate calls start in any sliding period of seconds """
+    def __init__(self, rate, period):
+        self.rate = rate
+        self.period = period
+        self._starts = collections.deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Waits until another call may start within the rate, then records and returns its start time """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._starts and self._starts[0] <= now - self.period:
+                    self._starts.popleft()
+                if len(self._starts) < self.rate:
+                    self._starts.append(now)
+                    return now
+                wait = self._starts[0] + self.period - now
+            time.sleep(wait)
+
+    def release(self, started):
+        """ Gives back the slot of a call the service turned away, so it doesn't count against the rate """
+        with self._lock:
+            if started in self._starts:
+                self._starts.remove(started)
+
+# Shared by all ARM calls in this runbook; no token is requested until the first call needs one
+credential = ManagedIdentityCredential()
+# Shared by all import requests so concurrent submissions stay within the account limits
+import_rate_limiter = RateLimiter(IMPORT_RATE_LIMIT, IMPORT_RATE_PERIOD_SECONDS)
+# Shared by all ARM calls, so imports drop the cached package listing
+arm_session = requests.Session()
+if arm_read_cache is not None:
+    arm_read_cache.mount(arm_session)
+
+def send_arm_request(method, request_url, **kwargs):
+    """ Sends an ARM request with the managed identity token, retrying once with a fresh token on 401 """
+    headers = kwargs.pop('headers', {})
+    headers['Authorization'] = 'Bearer %s' % credential.get_token()
+    r = arm_session.request(method, request_url, headers=headers, **kwargs)
+    if r.status_code == 401:
+        headers['Authorization'] = 'Bearer %s' % credential.get_token(force_refresh=True)
+        r = arm_session.request(method, request_url, headers=headers, **kwargs)
+    return r
+
+
+DistributionFile = collections.namedtuple(
+    'DistributionFile', ['filename', 'url', 'name', 'version', 'python_tags', 'abi_tags', 'platform_tags',
+                         'has_metadata', 'yanked', 'requires_python'])
+
+def normalize_package_name(packagename):
+    """ Returns the PEP 503 normalized form of a package name """
+    return re.sub(r"[-_.]+", "-", packagename).lower()
+
+def parse_distribution_filename(filename, url, has_metadata=False, yanked=False, requires_python=None):
+    """ Parses a wheel or sdist file name into a DistributionFile, or returns None if it can't be parsed """
+    match = WHEEL_FILENAME_REGEX.match(filename)
+    if match:
+        python_tags, abi_tags, platform_tags = [tuple(tag.split('.')) for tag in match.group('tags').split('-')]
+    else:
+        match = SDIST_FILENAME_REGEX.match(filename)
+        if not match:
+            return None
+        python_tags, abi_tags, platform_tags = (), (), ()
+    try:
+        version = packaging.version.Version(match.group('version'))
+    except packaging.version.InvalidVersion:
+        return None
+    return DistributionFile(filename, url, match.group('name'), version, python_tags, abi_tags, platform_tags,
+                            has_metadata, yanked, requires_python)
+
+def parse_simple_index_json(text):
+    """ Returns the (filename, url, has_metadata, yanked, requires_python) entries of a PEP 691 JSON project page """
+    return [(entry['filename'], entry['url'],
+             bool(entry.get('core-metadata', entry.get('data-dist-info-metadata'))),
+             bool(entry.get('yanked')), entry.get('requires-python'))
+            for entry in json.loads(text)['files']]
 
+def parse_simple_index_html(text):
+    """ Returns the (filename, url, has_metadata, yanked, requires_python) entries of a PEP 503 HTML project page """
+    files = []
+    for attributes, name in SIMPLE_INDEX_LINK_REGEX.findall(text):
+        attributes = dict(SIMPLE_INDEX_ATTRIBUTE_REGEX.findall(attributes))
+        if 'href' not in attributes:
+            continue
+        files.append((html.unescape(name).strip(), html.unescape(attributes['href']),
+                      attributes.get('data-core-metadata', attributes.get('data-dist-info-metadata', 'false')) != 'false',
+                      'data-yanked' in attributes, html.unescape(attributes.get('data-requires-python', '')) or None))
+    return files
 
-def extract_and_compare_version(url, min_req_version):
+def make_dirs(path):
+    """ Creates a directory and its parents, allowing another thread or job to create it at the same time """
     try:
-        re.search('\d+(\.\d+)+', url).group(0)        
-    except :
-         print ("Failed to extract and compare version URL  %s min_req_versionor %s" % (url, min_req_version))
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
 
-    extracted_ver = re.search('\d+(\.\d+)+', url).group(0)
-    print ("Extracted version   %s min_req_versionor %s" % (extracted_ver, min_req_version))
-    return packaging.version.parse(extracted_ver) >= packaging.version.parse(min_req_version)  
-    
-    
+class PackageIndex(object):
+    """ Fetches each project page from a simple index once and answers file lookups from memory """
+    def __init__(self, endpoint=PYPI_ENDPOINT, cache_dir=PYPI_CACHE_DIR):
+        self.endpoint = endpoint
+        # Each index gets its own cache, so a stand-in index never sees pages or metadata of another
+        self.cache_dir = os.path.join(cache_dir, hashlib.sha1(endpoint.rstrip('/').encode('utf-8')).hexdigest())
+        self.session = requests.Session()
+        self._projects = {}
+        self._lock = threading.Lock()
+
+    def _cache_path(self, project):
+        return os.path.join(self.cache_dir, project + ".json")
+
+    def _load_cached_page(self, project):
+        try:
+            with open(self._cache_path(project)) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+
+    def _save_cached_page(self, project, page):
+        make_dirs(self.cache_dir)
+        temp_path = self._cache_path(project) + ".%d.tmp" % threading.get_ident()
+        with open(temp_path, "w") as cache_file:
+            json.dump(page, cache_file)
+        os.replace(temp_path, self._cache_path(project))
+
+    def _fetch_page(self, project):
+        """ Returns the file entries of a project, revalidating the on-disk copy with its ETag """
+        cached = self._load_cached_page(project)
+        headers = {'Accept': SIMPLE_INDEX_ACCEPT}
+        if cached is not None and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        response = self.session.get("%s/%s/" % (self.endpoint, project), headers=headers)
+        if response.status_code == 304 and cached is not None:
+            return cached['files']
+        if response.status_code != 200:
+            raise Exception("Error reading project {0} from {1}. Error code is {2}".format(project, self.endpoint, str(response.status_code)))
+        if response.headers.get('Content-Type', '').startswith(SIMPLE_INDEX_JSON):
+            files = parse_simple_index_json(response.text)
+        else:
+            files = parse_simple_index_html(response.text)
+        files = [(filename, urllib.parse.urljoin(response.url, url), has_metadata, yanked, requires_python)
+                 for filename, url, has_metadata, yanked, requires_python in files]
+        if response.headers.get('ETag'):
+            self._save_cached_page(project, {'etag': response.headers['ETag'], 'files': files})
+        return files
+
+    def get_files(self, packagename):
+        """ Returns the parsed distribution files of a package, fetching its project page on first use """
+        project = normalize_package_name(packagename)
+        with self._lock:
+            if project in self._projects:
+                return self._projects[project]
+        records = []
+        for entry in self._fetch_page(project):
+            record = parse_distribution_filename(*entry)
+            if record is not None:
+                records.append(record)
+        with self._lock:
+            return self._projects.setdefault(project, records)
+
+    def find_best_wheel(self, packagename, specifier):
+        """ Returns the best wheel of the newest version allowed by specifier that has a compatible wheel """
+        return select_best_wheel(self.get_files(packagename), specifier)
+
+    def get_metadata(self, record):
+        """ Returns the core metadata of a wheel """
+        return email.parser.Parser().parsestr(self.get_metadata_content(record).decode('utf-8', 'replace'), headersonly=True)
+
+    def get_metadata_content(self, record):
+        """ Returns the raw core metadata of a wheel, from its PEP 658 metadata file when the index has one """
+        metadata_path = os.path.join(self.cache_dir, "metadata", record.filename + ".metadata")
+        try:
+            with open(metadata_path, "rb") as metadata_file:
+                content = metadata_file.read()
+        except IOError:
+            content = None
+        if content is None:
+            if record.has_metadata:
+                response = self.session.get(record.url.split('#')[0] + ".metadata")
+                if response.status_code != 200:
+                    raise Exception("Error reading metadata of {0}. Error code is {1}".format(record.filename, str(response.status_code)))
+                content = response.content
+            else:
+                # Older uploads have no metadata file, so read METADATA out of the wheel in memory
+                response = self.session.get(record.url.split('#')[0])
+                if response.status_code != 200:
+                    raise Exception("Error reading {0}. Error code is {1}".format(record.filename, str(response.status_code)))
+                with zipfile.ZipFile(io.BytesIO(response.content)) as wheel:
+                    content = wheel.read([name for name in wheel.namelist()
+                                          if re.match(r'^[^/]+\.dist-info/METADATA$', name)][0])
+            # Metadata of a published file never changes so it is cached without revalidation
+            make_dirs(os.path.dirname(metadata_path))
+            temp_path = metadata_path + ".%d.tmp" % threading.get_ident()
+            with open(temp_path, "wb") as metadata_file:
+                metadata_file.write(content)
+            os.replace(temp_path, metadata_path)
+        return content
+
+# Shared by all lookups in this runbook so each project page is fetched and parsed once
+package_index = PackageIndex()
+
+def compatible_tags(python_version, platforms):
+    """ Returns the (python, abi, platform) wheel tags a CPython interpreter supports, most preferred first """
+    major, minor = python_version
+    interpreter = "cp%d%d" % (major, minor)
+    tags = []
+    # Wheels built for this exact interpreter, then the stable ABI of this and older minor versions
+    tags.extend((interpreter, interpreter, platform) for platform in platforms)
+    tags.extend((interpreter, 'abi3', platform) for platform in platforms)
+    tags.extend((interpreter, 'none', platform) for platform in platforms)
+    for older_minor in range(minor - 1, 1, -1):
+        tags.extend(("cp%d%d" % (major, older_minor), 'abi3', platform) for platform in platforms)
+    # Pure python wheels, platform specific ones first
+    python_tags = ["py%d%d" % (major, minor), "py%d" % major] + ["py%d%d" % (major, older_minor) for older_minor in range(minor - 1, -1, -1)]
+    for python_tag in python_tags:
+        tags.extend((python_tag, 'none', platform) for platform in platforms)
+    tags.append((interpreter, 'none', 'any'))
+    tags.extend((python_tag, 'none', 'any') for python_tag in python_tags)
+    return tags
+
+def get_tag_ranks(python_version, platforms):
+    """ Returns a map of wheel tag to its rank, where a lower rank is preferred """
+    return dict((tag, rank) for rank, tag in enumerate(compatible_tags(python_version, platforms)))
+
+TARGET_TAG_RANKS = get_tag_ranks(TARGET_PYTHON_VERSION, TARGET_PLATFORMS)
+
+def wheel_rank(record, tag_ranks=TARGET_TAG_RANKS):
+    """ Returns the best rank of any tag a wheel supports, or None if it is not compatible """
+    ranks = [tag_ranks[(python_tag, abi_tag, platform_tag)]
+             for python_tag in record.python_tags
+             for abi_tag in record.abi_tags
+             for platform_tag in record.platform_tags
+             if (python_tag, abi_tag, platform_tag) in tag_ranks]
+    return min(ranks) if ranks else None
+
+@functools.lru_cache(maxsize=None)
+def _requires_python_allows(requires_python, python_full_version):
+    try:
+        return packaging.specifiers.SpecifierSet(requires_python).contains(python_full_version)
+    except packaging.specifiers.InvalidSpecifier:
+        return True
+
+def supports_target_python(record):
+    """ Returns whether the Requires-Python of a file allows the target interpreter """
+    return not record.requires_python or _requires_python_allows(record.requires_python, TARGET_ENVIRONMENT['python_full_version'])
+
+def select_best_wheel(records, specifier, newest=True, tag_ranks=TARGET_TAG_RANKS):
+    """
+    Returns the best compatible wheel among records whose version is allowed by specifier, in a single pass.
+    The newest (or oldest when newest is False) matching version wins, then the best ranked tag.
+    Yanked files are only considered when the specifier pins an exact version.
+    """
+    pinned = any(spec.operator in ('==', '===') for spec in specifier)
+    allowed_versions = {}
+    best, best_rank = None, None
+    for record in records:
+        if record.yanked and not pinned:
+            continue
+        if record.version not in allowed_versions:
+            allowed_versions[record.version] = specifier.contains(record.version)
+        if not allowed_versions[record.version]:
+            continue
+        rank = wheel_rank(record, tag_ranks)
+        if rank is None or not supports_target_python(record):
+            continue
+        if (best is None
+                or (record.version > best.version if newest else record.version < best.version)
+                or (record.version == best.version and rank < best_rank)):
+            best, best_rank = record, rank
+    return best
 
 def resolve_download_url(packagename, version):
-    response = requests.get("%s/%s" % (PYPI_ENDPOINT, packagename))
-    urls = re.findall(r'href=[\'"]?([^\'" >]+)', str(response.content))
-    for url in urls:
-        if 'cp38-win_amd64.whl' in url and version in url:
-            print ("Detected download uri %s for %s" % (url, packagename))
-            return(url)
-    for url in urls:
-        if 'py3-none-any.whl' in url and version in url:
-            print ("Detected download uri %s for %s" % (url, packagename))
-            return(url)
-    for url in urls:
-        if 'abi3-win_amd64.whl' in url and 'cp36' in url and version in url:
-            print ("Detected download uri %s for %s" % (url, packagename))
-            return(url)        
-    for url in urls:
-        if 'cp38-win_amd64.whl' in url and extract_and_compare_version(url,version):
-            print ("Detected download uri %s for %s" % (url, packagename))
-            return(url)            
-    for url in urls:
-        if 'py3-none-any.whl' in url and extract_and_compare_version(url,version):
-            print ("Detected download uri %s for %s" % (url, packagename))
-            return(url)  
-    print("Could not find WHL from PIPI for package %s and version %s" % (packagename, version))       
+    """ Returns the download url of the best wheel for a package version, falling back to the closest newer version """
+    try:
+        required_version = packaging.version.Version(version)
+    except packaging.version.InvalidVersion:
+        print ("Could not parse version %s for package %s" % (version, packagename))
+        return None
+    record = package_index.find_best_wheel(packagename, packaging.specifiers.SpecifierSet("==%s" % required_version))
+    if record is None:
+        record = select_best_wheel(package_index.get_files(packagename),
+                                   packaging.specifiers.SpecifierSet(">=%s" % required_version), newest=False)
+    if record is not None:
+        print ("Detected download uri %s for %s" % (record.url, packagename))
+        return record.url
+    print("Could not find WHL from PIPI for package %s and version %s" % (packagename, version))
+
+def find_best_wheel(packagename, specifier):
+    """ Returns the best wheel of the newest version allowed by specifier that has a compatible wheel """
+    return package_index.find_best_wheel(packagename, specifier)
+
+class LocalWheelhouseStore(object):
+    """ Keeps wheelhouse files in a local directory, served to Automation from a base url """
+    def __init__(self, path, base_url):
+        self.path = path
+        self.base_url = base_url
+
+    def read(self, name):
+        return self.read_versioned(name)[0]
+
+    def read_versioned(self, name):
+        """ Returns the content of a file and the version to write it back with, or None for both if it doesn't exist """
+        try:
+            with open(os.path.join(self.path, name), "rb") as wheelhouse_file:
+                content = wheelhouse_file.read()
+        except IOError:
+            return None, None
+        return content, hashlib.sha1(content).hexdigest()
+
+    def write(self, name, source_file):
+        target_path = os.path.join(self.path, name)
+        make_dirs(os.path.dirname(target_path))
+        temp_path = target_path + ".%d.tmp" % threading.get_ident()
+        with open(temp_path, "wb") as target_file:
+            shutil.copyfileobj(source_file, target_file)
+        os.replace(temp_path, target_path)
+
+    def write_if_unchanged(self, name, source_file, version):
+        """ Writes a file unless another job changed it since it was read at version, returning whether it was written """
+        lock_path = os.path.join(self.path, name + ".lock")
+        make_dirs(os.path.dirname(lock_path))
+        while True:
+            try:
+                lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - os.path.getmtime(lock_path) > WHEELHOUSE_LOCK_SECONDS:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            time.sleep(0.1)
+        try:
+            if self.read_versioned(name)[1] != version:
+                return False
+            self.write(name, source_file)
+            return True
+        finally:
+            os.close(lock_fd)
+            os.remove(lock_path)
+
+    def url_for(self, name):
+        return "%s/%s" % (self.base_url.rstrip('/'), urllib.parse.quote(name))
+
+class BlobWheelhouseStore(object):
+    """
+    Keeps wheelhouse files in a blob container, authorized by the SAS token in the container url.
+    Automation is given urls signed with the read only SAS token of read_url, so the other one isn't stored with the packages
+    """
+    def __init__(self, container_url, read_url):
+        parts = urllib.parse.urlsplit(container_url)
+        self.base_url = urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path.rstrip('/'), '', ''))
+        self.sas = parts.query
+        self.read_sas = urllib.parse.urlsplit(read_url).query
+        self.session = requests.Session()
+
+    def _blob_url(self, name):
+        return "%s/%s?%s" % (self.base_url, urllib.parse.quote(name), self.sas)
+
+    def read(self, name):
+        return self.read_versioned(name)[0]
+
+    def read_versioned(self, name):
+        """ Returns the content of a blob and its ETag, or None for both if it doesn't exist """
+        response = self.session.get(self._blob_url(name), headers={'x-ms-version': BLOB_API_VERSION})
+        if response.status_code == 404:
+            return None, None
+        if response.status_code != 200:
+            raise Exception("Error reading {0} from wheelhouse. Error code is {1}".format(name, str(response.status_code)))
+        return response.content, response.headers.get('ETag')
+
+    def _put(self, name, source_file, headers):
+        headers = dict(headers, **{'x-ms-version': BLOB_API_VERSION, 'x-ms-blob-type': 'BlockBlob'})
+        return self.session.put(self._blob_url(name), data=source_file, headers=headers)
+
+    def write(self, name, source_file):
+        response = self._put(name, source_file, {})
+        if response.status_code != 201:
+            raise Exception("Error writing {0} to wheelhouse. Error code is {1}".format(name, str(response.status_code)))
+
+    def write_if_unchanged(self, name, source_file, version):
+        """ Writes a blob unless another job changed it since it was read with the ETag version, returning whether it was written """
+        response = self._put(name, source_file, {'If-Match': version} if version is not None else {'If-None-Match': '*'})
+        if response.status_code in (409, 412):
+            return False
+        if response.status_code != 201:
+            raise Exception("Error writing {0} to wheelhouse. Error code is {1}".format(name, str(response.status_code)))
+        return True
+
+    def url_for(self, name):
+        return "%s/%s?%s" % (self.base_url, urllib.parse.quote(name), self.read_sas)
+
+class Wheelhouse(object):
+    """
+    A pinned mirror of the wheels this runbook imports, with a precomputed index read in a single request.
+    Lookups prefer the wheelhouse and fall back to the upstream index for anything it doesn't have yet.
+    """
+    def __init__(self, store, upstream):
+        self.store = store
+        self.upstream = upstream
+        self._lock = threading.Lock()
+        self._added = []
+        content = store.read(WHEELHOUSE_INDEX)
+        index = json.loads(content.decode('utf-8')) if content else {'projects': {}}
+        self._records = {}
+        for project, entries in index['projects'].items():
+            self._records[project] = [self._to_record(entry) for entry in entries]
+
+    def _to_record(self, entry):
+        return parse_distribution_filename(entry['filename'], self.store.url_for(entry['path']), True, False, entry.get('requires_python'))
+
+    def get_files(self, packagename):
+        """ Returns the wheelhouse files of a package followed by the upstream ones it doesn't have """
+        own = self._records.get(normalize_package_name(packagename), [])
+        filenames = set(record.filename for record in own)
+        return own + [record for record in self.upstream.get_files(packagename) if record.filename not in filenames]
+
+    def find_best_wheel(self, packagename, specifier):
+        """ Returns the wheelhouse's wheel when it has one allowed by specifier, the upstream best match otherwise """
+        record = select_best_wheel(self._records.get(normalize_package_name(packagename), []), specifier)
+        return record if record is not None else self.upstream.find_best_wheel(packagename, specifier)
+
+    def get_metadata(self, record):
+        return email.parser.Parser().parsestr(self.get_metadata_content(record).decode('utf-8', 'replace'), headersonly=True)
+
+    def get_metadata_content(self, record):
+        project = normalize_package_name(record.name)
+        if record in self._records.get(project, []):
+            content = self.store.read("%s/%s.metadata" % (project, record.filename))
+            if content is not None:
+                return content
+        return self.upstream.get_metadata_content(record)
+
+    def _sync_file(self, packagename, version):
+        """ Copies the upstream wheel of a package version into the wheelhouse, verifying its sha256 when known """
+        project = normalize_package_name(packagename)
+        record = select_best_wheel(self.upstream.get_files(packagename), packaging.specifiers.SpecifierSet("==%s" % version))
+        if record is None:
+            raise Exception("No compatible wheel found for {0} {1}".format(packagename, version))
+        path = "%s/%s" % (project, record.filename)
+        url, _, fragment = record.url.partition('#')
+        with tempfile.TemporaryFile() as wheel_file:
+            digest = hashlib.sha256()
+            with self.upstream.session.get(url, stream=True) as response:
+                if response.status_code != 200:
+                    raise Exception("Error downloading {0}. Error code is {1}".format(record.filename, str(response.status_code)))
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    digest.update(chunk)
+                    wheel_file.write(chunk)
+            if fragment.startswith('sha256=') and fragment[len('sha256='):] != digest.hexdigest():
+                raise Exception("Hash mismatch downloading {0}".format(record.filename))
+            wheel_file.seek(0)
+            self.store.write(path, wheel_file)
+        self.store.write(path + ".metadata", io.BytesIO(self.upstream.get_metadata_content(record)))
+        entry = {'filename': record.filename, 'path': path, 'requires_python': record.requires_python, 'sha256': digest.hexdigest()}
+        with self._lock:
+            self._added.append((project, entry))
+            self._records.setdefault(project, []).append(self._to_record(entry))
+        print ("Synced %s into wheelhouse" % record.filename)
+
+    def save_index(self):
+        """ Merges the wheels this run added into the latest index and writes it, again if another job wrote it first """
+        for attempt in range(WHEELHOUSE_INDEX_RETRIES):
+            content, version = self.store.read_versioned(WHEELHOUSE_INDEX)
+            index = json.loads(content.decode('utf-8')) if content else {'projects': {}}
+            for project, entry in self._added:
+                entries = index['projects'].setdefault(project, [])
+                if entry['filename'] not in [existing['filename'] for existing in entries]:
+                    entries.append(entry)
+            index_file = io.BytesIO(json.dumps(index, indent=1, sort_keys=True).encode('utf-8'))
+            if self.store.write_if_unchanged(WHEELHOUSE_INDEX, index_file, version):
+                return
+        raise Exception("Error saving the wheelhouse index, other jobs kept changing it")
+
+    def sync(self, dep_map):
+        """ Copies the wheels of every package in dep_map that the wheelhouse doesn't have, then saves its index """
+        missing = [(packagename, version) for packagename, version in dep_map.items()
+                   if select_best_wheel(self._records.get(normalize_package_name(packagename), []),
+                                        packaging.specifiers.SpecifierSet("==%s" % version)) is None]
+        if not missing:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_RESOLVE_WORKERS) as executor:
+            for future in [executor.submit(self._sync_file, packagename, version) for packagename, version in missing]:
+                future.result()
+        self.save_index()
+
+def get_requirements(record, extras):
+    """ Returns the requirements of a wheel that apply to the target environment with the given extras """
+    requirements = []
+    for line in package_index.get_metadata(record).get_all('Requires-Dist') or []:
+        requirement = packaging.requirements.Requirement(line)
+        if requirement.marker is not None and not any(
+                requirement.marker.evaluate(dict(TARGET_ENVIRONMENT, extra=extra)) for extra in ('',) + tuple(extras)):
+            continue
+        requirements.append(requirement)
+    return requirements
+
+def _resolve_requirement(packagename, specifier, record, extras):
+    if record is None:
+        record = find_best_wheel(packagename, specifier)
+        if record is None:
+            raise Exception("No compatible wheel of {0} satisfies {1}".format(packagename, specifier or "any version"))
+    return record, get_requirements(record, extras)
+
+def resolve_dependencies(packagename, version):
+    """
+    Returns an ordered map of package name to version for a package and all of its dependencies.
+    Only the project pages and wheel metadata files are downloaded, nothing is installed.
+    Every requirement of a package narrows the versions it may have. When the version already picked
+    no longer satisfies them all, the newest one that does is picked instead, or resolution fails if there is none.
+    """
+    names = collections.OrderedDict()
+    specifiers = {}
+    # Normalized name to the (record, extras, requirements) picked for it
+    resolved = {}
+    pending = [packaging.requirements.Requirement("%s==%s" % (packagename, version))]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_RESOLVE_WORKERS) as executor:
+        while pending:
+            # Merge the specifiers and extras of every requirement of a package in this level of the tree
+            level = collections.OrderedDict()
+            for requirement in pending:
+                key = normalize_package_name(requirement.name)
+                names.setdefault(key, requirement.name)
+                specifiers[key] = specifiers.get(key, packaging.specifiers.SpecifierSet()) & requirement.specifier
+                level.setdefault(key, set()).update(requirement.extras)
+            # Then fetch every new or re-picked project of the level at once
+            futures = collections.OrderedDict()
+            for key, extras in level.items():
+                record, resolved_extras = resolved[key][:2] if key in resolved else (None, set())
+                if record is not None and not specifiers[key].contains(record.version, prereleases=True):
+                    print ("%s %s does not satisfy %s, picking another version" % (names[key], record.version, specifiers[key]))
+                    record = None
+                elif record is not None and extras <= resolved_extras:
+                    continue
+                extras = extras | resolved_extras
+                futures[key] = (executor.submit(_resolve_requirement, names[key], specifiers[key], record, extras), extras)
+            pending = []
+            for key, (future, extras) in futures.items():
+                record, requirements = future.result()
+                resolved[key] = (record, extras, requirements)
+                pending.extend(requirements)
+    # A re-picked version may no longer need the dependencies of the version it replaced
+    needed = set()
+    keys = [normalize_package_name(packagename)]
+    while keys:
+        key = keys.pop()
+        if key not in needed:
+            needed.add(key)
+            keys.extend(normalize_package_name(requirement.name) for requirement in resolved[key][2])
+    return collections.OrderedDict((names[key], str(resolved[key][0].version)) for key in names if key in needed)
 
 def send_webservice_import_module_request(packagename, download_uri_for_file):
     request_url = "https://management.azure.com/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Automation/automationAccounts/%s/python3Packages/%s?api-version=2018-06-30" \
                   % (subscription_id, resource_group, automation_account, packagename)
 
     requestbody = { 'properties': { 'description': 'uploaded via automation', 'contentLink': {'uri': "%s" % download_uri_for_file} } }
-    headers = {'Content-Type' : 'application/json', 'Authorization' : 'Bearer %s' % token}
-    r = requests.put(request_url, data=json.dumps(requestbody), headers=headers)
+    headers = {'Content-Type' : 'application/json'}
+    for attempt in range(MAX_IMPORT_RETRIES + 1):
+        started = import_rate_limiter.acquire()
+        r = send_arm_request("PUT", request_url, data=json.dumps(requestbody), headers=headers)
+        if r.status_code != 429 or attempt == MAX_IMPORT_RETRIES:
+            break
+        # Throttled by the account, so this attempt started no import. Wait for as long as ARM asks before trying again
+        import_rate_limiter.release(started)
+        time.sleep(float(r.headers.get('Retry-After', IMPORT_RATE_PERIOD_SECONDS)))
     if str(r.status_code) not in ["200", "201"]:
         raise Exception("Error importing package {0} into Automation account. Error code is {1}".format(packagename, str(r.status_code)))
 
-def find_and_dependencies(packagename, version, dep_graph, dep_map):
-    dep_map.update({packagename: version})
-    for child in dep_graph:
-        if child['package']['key'].casefold() == packagename.casefold():
-            for dep in child['dependencies']:
-                version = dep['installed_version'] 
-                if version == '?' :
-                    version = dep['required_version'][2:]
-                    if "!" in version :
-                        version = version .split('!')[0]
-                find_and_dependencies(dep['package_name'],version,dep_graph, dep_map)  
-                
+def get_imported_packages(fresh=False):
+    """
+    Returns a map of normalized package name to the python 3 package resources already in the Automation account.
+    fresh revalidates a cached listing instead of using it while it is within its time to live
+    """
+    request_url = "https://management.azure.com/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Automation/automationAccounts/%s/python3Packages?api-version=2018-06-30" \
+                  % (subscription_id, resource_group, automation_account)
+    packages = {}
+    while request_url:
+        r = send_arm_request("GET", request_url, headers={'Cache-Control': 'no-cache'} if fresh else {})
+        if r.status_code != 200:
+            raise Exception("Error listing packages in Automation account. Error code is {0}".format(str(r.status_code)))
+        page = r.json()
+        for package in page.get('value', []):
+            packages[normalize_package_name(package['name'])] = package
+        request_url = page.get('nextLink')
+    return packages
 
-subprocess.check_call([sys.executable, '-m', 'pip', 'install','pipdeptree'])
+def is_package_imported(package, version):
+    """ Returns whether an imported package resource has this version and imported successfully """
+    properties = package.get('properties') or {}
+    if properties.get('provisioningState') != 'Succeeded' or not properties.get('version'):
+        return False
+    try:
+        return packaging.version.Version(properties['version']) == packaging.version.Version(version)
+    except packaging.version.InvalidVersion:
+        return properties['version'] == version
+
+def filter_imported_packages(dep_map, imported_packages):
+    """ Returns the entries of dep_map that are missing from the account or imported with another version """
+    missing = collections.OrderedDict()
+    for packagename, version in dep_map.items():
+        package = imported_packages.get(normalize_package_name(packagename))
+        if package is not None and is_package_imported(package, version):
+            print ("Package %s %s is already imported, skipping" % (packagename, version))
+        else:
+            missing[packagename] = version
+    return missing
+
+def import_package(packagename, version):
+    """ Resolves the wheel for a package and submits its import, returning the download uri used """
+    download_uri_for_file = resolve_download_url(packagename, version)
+    if download_uri_for_file is None:
+        raise Exception("No wheel found for package {0} version {1}".format(packagename, version))
+    send_webservice_import_module_request(packagename, download_uri_for_file)
+    return download_uri_for_file
+
+class ImportTracker(object):
+    """ Tracks the provisioning state of submitted imports with a single listing of the account per poll """
+    def __init__(self):
+        self.pending = collections.OrderedDict()
+        self.results = collections.OrderedDict()
+
+    def add(self, packagename):
+        """ Starts tracking a package whose import was just submitted """
+        self.pending[normalize_package_name(packagename)] = (packagename, time.monotonic())
 
-subprocess.check_call([sys.executable, '-m', 'pip', 'install','packaging'])
+    def settle(self, packagename, state, reason=None):
+        """ Records the final state of a package, whether or not it was ever submitted """
+        key = normalize_package_name(packagename)
+        submitted_at = self.pending.pop(key, (packagename, time.monotonic()))[1]
+        duration = time.monotonic() - submitted_at
+        self.results[packagename] = (state, duration, reason)
+        if state == 'Succeeded':
+            print ("Package %s imported in %d seconds" % (packagename, duration))
+        else:
+            print ("Package %s %s after %d seconds: %s" % (packagename, state.lower(), duration, reason))
 
+    def poll(self):
+        """ Lists the account once and settles every tracked package that reached a terminal state """
+        imported_packages = get_imported_packages(fresh=True)
+        for key, (packagename, submitted_at) in list(self.pending.items()):
+            properties = (imported_packages.get(key) or {}).get('properties') or {}
+            state = properties.get('provisioningState')
+            if state in IMPORT_TERMINAL_STATES:
+                error = properties.get('error') or {}
+                self.settle(packagename, state, error.get('message') or error.get('code'))
+
+    def failures(self):
+        return [packagename for packagename, (state, duration, reason) in self.results.items() if state != 'Succeeded']
+
+def import_packages(dep_map):
+    """ Submits imports for all packages in dep_map concurrently and tracks them until the last one settles """
+    tracker = ImportTracker()
+    started = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_IMPORT_WORKERS) as executor:
+        futures = dict((executor.submit(import_package, name, version), name) for name, version in dep_map.items())
+        not_done = set(futures)
+        delay = IMPORT_POLL_INITIAL_SECONDS
+        next_poll = time.monotonic() + delay
+        # One loop both collects submissions as they complete and polls the imports they started
+        while not_done or tracker.pending:
+            if not_done:
+                timeout = max(0, next_poll - time.monotonic()) if tracker.pending else None
+                done, not_done = concurrent.futures.wait(not_done, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    packagename = futures[future]
+                    try:
+                        print ("Submitted import of %s from %s" % (packagename, future.result()))
+                        if not tracker.pending:
+                            next_poll = max(next_poll, time.monotonic() + delay)
+                        tracker.add(packagename)
+                    except Exception as e:
+                        tracker.settle(packagename, 'Failed', "import request was not accepted: %s" % e)
+            else:
+                time.sleep(max(0, next_poll - time.monotonic()))
+            if tracker.pending and time.monotonic() >= next_poll:
+                tracker.poll()
+                if time.monotonic() - started > IMPORT_TIMEOUT_SECONDS:
+                    for packagename, submitted_at in list(tracker.pending.values()):
+                        tracker.settle(packagename, 'TimedOut', "import did not settle in %d seconds" % IMPORT_TIMEOUT_SECONDS)
+                delay = min(delay * IMPORT_POLL_BACKOFF, IMPORT_POLL_MAX_SECONDS)
+                next_poll = time.monotonic() + delay
+    print ("Imported %d of %d packages in %d seconds" % (len(tracker.results) - len(tracker.failures()), len(tracker.results), time.monotonic() - started))
+    if tracker.failures():
+        raise Exception("Error importing packages {0} into Automation account".format(", ".join(tracker.failures())))
 
 if __name__ == '__main__':
     if len(sys.argv) < 9:
@@ -124,8 +855,11 @@ if __name__ == '__main__':
     automation_account = None
     module_name = None
     version_name = None
+    index_url = None
+    wheelhouse = None
+    wheelhouse_url = None
 
-    opts, args = getopt.getopt(sys.argv[1:], "s:g:a:m:v:")
+    opts, args = getopt.getopt(sys.argv[1:], "s:g:a:m:v:i:w:u:")
     for o, i in opts:
         if o == '-s':  
             subscription_id = i.replace('"', '').replace("'","")
@@ -137,24 +871,32 @@ if __name__ == '__main__':
             module_name = i.replace('"', '').replace("'","")
         elif o == '-v':
             version_name = i.replace('"', '').replace("'","")    
+        elif o == '-i':
+            index_url = i.replace('"', '').replace("'","").rstrip('/')
+        elif o == '-w':
+            wheelhouse = i.replace('"', '').replace("'","")
+        elif o == '-u':
+            wheelhouse_url = i.replace('"', '').replace("'","")
 
-    module_with_version = module_name + "==" + version_name
-    # Install the given module first
-    for i in (1,10):
-        try:
-            subprocess.check_call([sys.executable, '-m', 'pip', 'install', module_with_version])
-            break
-        except subprocess.CalledProcessError as e:
-            continue 
-
-    result = subprocess.run(
-        [sys.executable, "-m", "pipdeptree","-j"], capture_output=True, text=True
-    )
-    dep_graph = json.loads(result.stdout)
-    dep_map = {}
-    find_and_dependencies(module_name,version_name,dep_graph,dep_map)
+    if index_url is not None:
+        package_index = PackageIndex(index_url)
+    if wheelhouse is not None:
+        if wheelhouse_url is None:
+            raise ValueError("A wheelhouse url -u must be specified with a wheelhouse -w so Automation can download the packages")
+        if wheelhouse.startswith("https://"):
+            store = BlobWheelhouseStore(wheelhouse, wheelhouse_url)
+        else:
+            store = LocalWheelhouseStore(wheelhouse, wheelhouse_url)
+        package_index = Wheelhouse(store, package_index)
+
+    # Resolve the package and its dependencies from the index metadata without installing anything
+    dep_map = resolve_dependencies(module_name, version_name)
+    if wheelhouse is not None:
+        # Mirror anything new so the imports and later runs are served from the wheelhouse
+        package_index.sync(dep_map)
+    # Only import the packages that the account doesn't already have at the resolved version
+    dep_map = filter_imported_packages(dep_map, get_imported_packages())
     # Import package with dependencies from pypi.org
-    for module_name,version in dep_map.items():
-        download_uri_for_file = resolve_download_url(module_name, version)
-        send_webservice_import_module_request(module_name, download_uri_for_file)
-        time.sleep(10)
+    import_packages(dep_map)
+    if arm_read_cache is not None:
+        print (arm_read_cache.get_shared_cache().summary())
@@ -5,9 +5,12 @@
     You can upload the package to a storage account from your local system and then this
     runbook will download the package so it can be imported when the job is run.
 """
-def install_packages(local_file_path, storage_account_name, storage_resource_group, storage_account_container_name):
+def install_packages(local_file_path, storage_account_name, storage_resource_group, storage_account_container_name,
+                     extract_archives=False):
     """
     Copies folders or files in a container from an Azure storage account to a local directory.
+    With extract_archives, .zip, .tar, .tar.gz, .tgz and .gz blobs are extracted while they download instead,
+    using storage_blob_helpers.
 
         Example 1:
                 install_packages.py -p <local_file_path> -r <resource_group> -a <storage_account_name> -c <storage_account_container_name>
@@ -15,13 +18,22 @@ def install_packages(local_file_path, storage_account_name, storage_resource_gro
     Changelog:
         2017-09-11 AutomationTeam:
         -initial script
+        2026-10-19 AutomationTeam:
+        -Extract archives straight from the download stream, checking each range and member as it arrives
+        -Authenticate with a container SAS token reused across jobs until close to expiry instead of listing keys every run
+        -Share the SAS token and archive extraction helpers with download_storage_container through storage_blob_helpers
 
     """
     import os
     import base64
     import automationassets
     import azure.mgmt.storage
+    from azure.common import AzureHttpError
     from azure.storage.blob import BlockBlobService
+    try:
+        import storage_blob_helpers
+    except ImportError:
+        storage_blob_helpers = None
 
     def get_automation_runas_credential(runas_connection):
         """ Returns credentials to authenticate against Azure resoruce manager """
@@ -83,28 +95,46 @@ def install_packages(local_file_path, storage_account_name, storage_resource_gro
             or storage_account_container_name is None):
         raise ValueError("local direcotry, storage resource group, storage account, and container must be specified as arguments")
 
-    # Authenticate to Azure resource manager
+    if extract_archives and storage_blob_helpers is None:
+        raise ValueError("Extracting archives requires the storage_blob_helpers runbook")
+
+    # Saved SAS tokens are only reused by jobs running as the same RunAs connection
     automation_runas_connection = automationassets.get_automation_connection("AzureRunAsConnection")
-    azure_credential = get_automation_runas_credential(automation_runas_connection)
-    subscription_id = str(automation_runas_connection["SubscriptionId"])
-
-    # Get storage key
-    storage_client = azure.mgmt.storage.StorageManagementClient(
-        azure_credential,
-        subscription_id)
-
-    storage_keys = storage_client.storage_accounts.list_keys(storage_resource_group, storage_account_name)
-    storage_account_key = storage_keys.keys[0].value
-    # Authenticate to the storage account
-    blobservice = BlockBlobService(account_name=storage_account_name, account_key=storage_account_key)
+
+    def get_storage_client():
+        """ Authenticates to Azure resource manager, which is only needed when a storage key is listed """
+        azure_credential = get_automation_runas_credential(automation_runas_connection)
+        subscription_id = str(automation_runas_connection["SubscriptionId"])
+        return azure.mgmt.storage.StorageManagementClient(
+            azure_credential,
+            subscription_id)
+
+    # Authenticate to the storage account, with a saved SAS token where storage_blob_helpers is available
+    if storage_blob_helpers is not None:
+        storage_credentials = storage_blob_helpers.StorageCredentialProvider(get_storage_client, automation_runas_connection)
+        blobservice = storage_credentials.get_blob_service(storage_resource_group, storage_account_name, storage_account_container_name)
+    else:
+        storage_keys = get_storage_client().storage_accounts.list_keys(storage_resource_group, storage_account_name)
+        blobservice = BlockBlobService(account_name=storage_account_name, account_key=storage_keys.keys[0].value)
     # If local directory does not exist, create it
     if not os.path.exists(local_file_path):
         os.makedirs(local_file_path)
 
-    blobs = blobservice.list_blobs(storage_account_container_name)
+    try:
+        blobs = blobservice.list_blobs(storage_account_container_name)
+    except AzureHttpError as e:
+        if e.status_code != 403 or storage_blob_helpers is None:
+            raise
+        # The saved token no longer works, most likely because the account keys were rotated
+        blobservice = storage_credentials.get_blob_service(storage_resource_group, storage_account_name,
+                                                           storage_account_container_name, renew=True)
+        blobs = blobservice.list_blobs(storage_account_container_name)
     # Dowload all blobs from the container and create local file system to match
     for blob in blobs:
-        download_blob(blob, local_file_path)
+        if extract_archives and blob.name.lower().endswith(storage_blob_helpers.ARCHIVE_EXTENSIONS):
+            storage_blob_helpers.extract_blob(blobservice, storage_account_container_name, blob, local_file_path)
+        else:
+            download_blob(blob, local_file_path)
   
 # Copy the pytz package from the pytz container in the storage account to the local python packages        
 install_packages("c:\Python27\Lib\site-packages", "pythonmodules", "pythonmodules", "pytz")
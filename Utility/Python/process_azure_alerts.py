@@ -3,27 +3,502 @@
 Processes a webhook sent from an Azure alert.
 
 This Azure Automation sample runbook runs on Azure to process an alert sent
-through a webhook. It converts the RequestBody into a Python object
-by loading the json string sent in.
+through a webhook. It decodes the RequestBody straight out of the webhook
+parameter and loads it into an Alert record.
+
+It can also run as a long-lived receiver on a Hybrid Worker, accepting alerts
+posted over HTTP and acting on them without starting a job for each one:
+
+    process_azure_alerts.py -p <port> [-b <address>]
+
+The receiver only starts when the ALERT_RECEIVER_TOKEN environment variable is
+set, and requests must send the same value in an "Authorization: Bearer <token>"
+header. It listens on 127.0.0.1 unless another address is passed with -b and
+speaks plain HTTP, so put a reverse proxy that terminates TLS, such as nginx or
+IIS with Application Request Routing, in front of it and let only the proxy
+reach the port.
+
+Alerts can be posted as the alert json itself or in the webhook data format.
+The receiver collects alerts for _RECEIVER_BATCH_SECONDS and acts on each
+batch once, so an alert storm only triggers one action per alert rule and resource.
+
+A job started for each alert acts on it alone. Jobs can't share what they
+have handled safely, so repeats during a storm are only skipped by the receiver.
 
 Changelog:
     2018-09-01 AutomationTeam:
     -initial script
+    2026-10-19 AutomationTeam:
+    -Decode the RequestBody in a single pass instead of rebuilding and slicing the payload
+    -Load alerts in the common alert schema into compact Alert records
+    -Collect alerts in the receiver into one batch per time window, skipping repeats of the same rule and resource
+    -Route alerts to actions such as starting or stopping VMs through an indexed routing table, printing unrouted alerts
+    -Add a token protected resident HTTP receiver mode with a credential shared by all alerts
 
 """
 import sys
+import BaseHTTPServer
+import collections
+import fnmatch
+import getopt
+import hmac
+import itertools
 import json
+import os
+import Queue
+import re
+import SocketServer
+import threading
+import time
+
+_DECODER = json.JSONDecoder()
+
+# Alerts for the same rule, resource and condition within this many seconds are handled once
+_DEDUPE_WINDOW_SECONDS = 300
+
+# Max number of alert actions to run at a time
+_MAX_THREADS = 20
+
+# Address the receiver listens on, and seconds it collects alerts for before acting on them as one batch
+_RECEIVER_HOST = "127.0.0.1"
+_RECEIVER_BATCH_SECONDS = 10
+
+# Routes are tried in order and the first one matching an alert decides its action. Leave out alert_rule,
+# severity, resource_type or resource_id to match any value. resource_id can be a shell-style pattern.
+# Routes only match Fired alerts unless they set monitor_condition, for example to Resolved.
+# Only logging is enabled by default; uncomment the VM routes, changed to match your alert rules, to act on VMs
+_ROUTES = [
+    # {"alert_rule": "VM Heartbeat Missing", "resource_type": "microsoft.compute/virtualmachines",
+    #  "action": "start_vm"},
+    # {"alert_rule": "Low CPU", "resource_type": "microsoft.compute/virtualmachines",
+    #  "resource_id": "/subscriptions/*/resourcegroups/dev-*", "action": "stop_vm"},
+    {"severity": "Sev0", "action": "log"},
+]
+
+
+class Alert(object):
+    """
+    An alert in the common alert schema. The fields every alert needs are read up front,
+    anything else in the essentials is available through get() and the alert context is kept as sent
+    """
+    __slots__ = ('alert_id', 'alert_rule', 'severity', 'signal_type', 'monitor_condition', 'target_ids',
+                 'fired_time', '_essentials', '_context', '_dimensions')
+
+    def __init__(self, body):
+        data = body.get("data", body)
+        essentials = data.get("essentials")
+        if essentials is None:
+            # Older metric alerts send their fields in a single context object
+            context = data.get("context", {})
+            essentials = {"alertId": context.get("id"), "alertRule": context.get("name"), "signalType": "Metric",
+                          "monitorCondition": "Fired" if data.get("status") == "Activated" else data.get("status"),
+                          "alertTargetIDs": [context["resourceId"]] if "resourceId" in context else [],
+                          "firedDateTime": context.get("timestamp")}
+            self._context = context
+        else:
+            self._context = data.get("alertContext") or {}
+        self.alert_id = essentials.get("alertId")
+        self.alert_rule = essentials.get("alertRule")
+        self.severity = essentials.get("severity")
+        self.signal_type = essentials.get("signalType")
+        self.monitor_condition = essentials.get("monitorCondition")
+        self.target_ids = tuple(target_id.lower() for target_id in essentials.get("alertTargetIDs") or ())
+        self.fired_time = essentials.get("firedDateTime")
+        self._essentials = essentials
+        self._dimensions = None
+
+    @property
+    def resource_id(self):
+        """ The lower-cased ID of the first resource the alert fired for """
+        return self.target_ids[0] if self.target_ids else None
+
+    @property
+    def resource_type(self):
+        """ The lower-cased provider namespace and type of the resource, such as microsoft.compute/virtualmachines """
+        parts = (self.resource_id or "").split("/")
+        if "providers" not in parts:
+            return None
+        provider = parts.index("providers")
+        return "/".join(parts[provider + 1:provider + 3] + parts[provider + 4::2])
+
+    @property
+    def key(self):
+        """ The (alert rule, resource ID) pair that identifies repeats of the same alert """
+        return (self.alert_rule, self.resource_id)
+
+    @property
+    def alert_context(self):
+        """ The alert context exactly as sent, which differs by signal type """
+        return self._context
+
+    @property
+    def dimensions(self):
+        """ Dimension name -> value for metric alerts, collected from every condition on first use """
+        if self._dimensions is None:
+            dimensions = {}
+            condition = self._context.get("condition") or {}
+            for criterion in condition.get("allOf") or ():
+                for dimension in criterion.get("dimensions") or ():
+                    dimensions[dimension["name"]] = dimension["value"]
+            self._dimensions = dimensions
+        return self._dimensions
+
+    def get(self, name, default=None):
+        """ Returns any other essentials field, such as description or resolvedDateTime, by its schema name """
+        return self._essentials.get(name, default)
+
+    def __repr__(self):
+        return "Alert(rule=%r, severity=%r, condition=%r, resource=%r)" % (
+            self.alert_rule, self.severity, self.monitor_condition, self.resource_id)
+
+
+class AlertBatcher(object):
+    """
+    Collects alerts into batches of distinct (alert rule, resource ID) pairs, opening a batch with the first
+    alert and closing it window_seconds later. A repeat replaces the earlier alert, so the latest condition wins
+    """
+
+    def __init__(self, window_seconds=_RECEIVER_BATCH_SECONDS):
+        self.window_seconds = window_seconds
+        self.duplicates = 0
+        self._alerts = collections.OrderedDict()
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def add(self, alert):
+        """ Adds an alert to the open batch, returning False if it repeats one already in it """
+        with self._lock:
+            if self._opened is None:
+                self._opened = time.time()
+            duplicate = self._alerts.pop(alert.key, None) is not None
+            if duplicate:
+                self.duplicates += 1
+            self._alerts[alert.key] = alert
+            return not duplicate
+
+    def seconds_until_ready(self):
+        """ Seconds until the open batch closes, or None if no batch is open """
+        with self._lock:
+            if self._opened is None:
+                return None
+            return max(0, self._opened + self.window_seconds - time.time())
+
+    def flush(self):
+        """ Closes the open batch and returns its alerts in the order their keys first arrived """
+        with self._lock:
+            alerts = list(self._alerts.values())
+            self._alerts = collections.OrderedDict()
+            self._opened = None
+            return alerts
+
+
+def claim_alert(alert, recent_alerts, now=None):
+    """
+    Records an alert in recent_alerts (alert key -> [condition, time handled]) and returns True,
+    or returns False if the same condition was already handled for its key within _DEDUPE_WINDOW_SECONDS
+    """
+    now = now or time.time()
+    key = "|".join(str(part) for part in alert.key)
+    for other_key in [other_key for other_key, (_, handled) in recent_alerts.items()
+                      if now - handled >= _DEDUPE_WINDOW_SECONDS]:
+        del recent_alerts[other_key]
+    if key in recent_alerts and recent_alerts[key][0] == alert.monitor_condition:
+        return False
+    recent_alerts[key] = [alert.monitor_condition, now]
+    return True
+
+
+class AlertRouter(object):
+    """
+    Routing table compiled into an index on (monitor condition, alert rule, severity, resource type, resource ID),
+    where None stands for any value other than the condition. Routing an alert looks up the 16 combinations of its
+    values and None, so the cost doesn't grow with the number of routes, except for resource ID patterns sharing
+    the same other values
+    """
+
+    def __init__(self, routes, actions):
+        self.actions = actions
+        self._index = {}
+        for order, route in enumerate(routes):
+            if route["action"] not in actions:
+                raise ValueError("Route " + str(order) + " uses unknown action " + route["action"])
+            resource_id = route.get("resource_id")
+            resource_type = route.get("resource_type")
+            matcher = None
+            if resource_id is not None:
+                resource_id = resource_id.lower()
+                if any(char in resource_id for char in "*?["):
+                    matcher = re.compile(fnmatch.translate(resource_id)).match
+                    resource_id = None
+            key = (route.get("monitor_condition", "Fired"), route.get("alert_rule"), route.get("severity"),
+                   resource_type.lower() if resource_type else None, resource_id)
+            # Buckets stay in table order, so the first match in a bucket is its best route
+            self._index.setdefault(key, []).append((order, matcher, route["action"]))
+
+    def route(self, alert):
+        """ Returns the name of the action for an alert, or None if no route matches it """
+        best = None
+        condition = alert.monitor_condition or "Fired"
+        for key in itertools.product((condition,), (alert.alert_rule, None), (alert.severity, None),
+                                     (alert.resource_type, None), (alert.resource_id, None)):
+            for order, matcher, action in self._index.get(key, ()):
+                if best is not None and order >= best[0]:
+                    break
+                if matcher is None or (alert.resource_id is not None and matcher(alert.resource_id)):
+                    best = (order, action)
+                    break
+        return best[1] if best else None
+
+    def route_batch(self, alerts):
+        """ Routes a batch of alerts in one pass, returning action name -> alerts with None for unrouted ones """
+        routed = collections.OrderedDict()
+        for alert in alerts:
+            routed.setdefault(self.route(alert), []).append(alert)
+        return routed
+
+    def dispatch(self, alerts):
+        """ Runs the action for every alert using at most _MAX_THREADS threads and returns any that failed """
+        work = Queue.Queue()
+        for action, routed_alerts in self.route_batch(alerts).items():
+            for alert in routed_alerts:
+                if action is None:
+                    print "No route for " + repr(alert)
+                else:
+                    work.put((action, alert))
+        failed = []
+
+        def worker():
+            while True:
+                try:
+                    action, alert = work.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    self.actions[action](alert)
+                except Exception as e:
+                    print "Action " + action + " failed for " + repr(alert) + ": " + str(e)
+                    failed.append(alert)
+                sys.stdout.flush()
+
+        threads = [threading.Thread(target=worker) for _ in range(min(_MAX_THREADS, work.qsize()))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return failed
+
+
+# RunAs credential and a compute client for each subscription alerts were raised in, created on first use
+_credential = []
+_compute_clients = {}
+_compute_clients_lock = threading.Lock()
+
+
+def get_automation_runas_credential(runas_connection):
+    """ Returs a credential that can be used to authenticate against Azure resources """
+    from OpenSSL import crypto
+    from msrestazure import azure_active_directory
+    import adal
+    import automationassets
+
+    # Get the Azure Automation RunAs service principal certificate
+    cert = automationassets.get_automation_certificate("AzureRunAsCertificate")
+    sp_cert = crypto.load_pkcs12(cert)
+    pem_pkey = crypto.dump_privatekey(crypto.FILETYPE_PEM, sp_cert.get_privatekey())
+
+    # Get run as connection information for the Azure Automation service principal
+    application_id = runas_connection["ApplicationId"]
+    thumbprint = runas_connection["CertificateThumbprint"]
+    tenant_id = runas_connection["TenantId"]
+
+    # Authenticate with service principal certificate
+    resource = "https://management.core.windows.net/"
+    authority_url = ("https://login.microsoftonline.com/" + tenant_id)
+    context = adal.AuthenticationContext(authority_url)
+    return azure_active_directory.AdalAuthentication(
+        lambda: context.acquire_token_with_client_certificate(
+            resource,
+            application_id,
+            pem_pkey,
+            thumbprint)
+    )
+
+
+def get_credential():
+    """ Returns the credential of the RunAs connection, loading its certificate only once """
+    with _compute_clients_lock:
+        if not _credential:
+            import automationassets
+            runas_connection = automationassets.get_automation_connection("AzureRunAsConnection")
+            _credential.append(get_automation_runas_credential(runas_connection))
+        return _credential[0]
+
+
+def get_compute_client(subscription_id):
+    """ Returns a compute client for the subscription, creating it on first use """
+    credential = get_credential()
+    with _compute_clients_lock:
+        if subscription_id not in _compute_clients:
+            import azure.mgmt.compute
+            _compute_clients[subscription_id] = azure.mgmt.compute.ComputeManagementClient(credential, subscription_id)
+        return _compute_clients[subscription_id]
+
+
+def get_vm(alert):
+    """ Returns the compute client, resource group and name of the VM an alert fired for """
+    parts = alert.resource_id.split("/")
+    return get_compute_client(parts[2]), parts[4], parts[8]
+
+
+def start_vm(alert):
+    """ Starts the VM an alert fired for """
+    compute_client, resource_group, vm_name = get_vm(alert)
+    print "Starting " + vm_name + " in resource group " + resource_group
+    compute_client.virtual_machines.start(resource_group, vm_name).wait()
+
+
+def stop_vm(alert):
+    """ Stops (deallocates) the VM an alert fired for """
+    compute_client, resource_group, vm_name = get_vm(alert)
+    print "Stopping " + vm_name + " in resource group " + resource_group
+    compute_client.virtual_machines.deallocate(resource_group, vm_name).wait()
+
+
+def log_alert(alert):
+    """ Prints the alert without acting on it """
+    print alert
+
+
+# Actions routes can name
+_ACTIONS = {"start_vm": start_vm, "stop_vm": stop_vm, "log": log_alert}
+
+
+def handle_alerts(alerts, router=None):
+    """ Acts on a batch of distinct alerts through the routing table """
+    router = router or AlertRouter(_ROUTES, _ACTIONS)
+    return router.dispatch(alerts)
+
+
+def parse_request_body(args):
+    """ Decodes the RequestBody json in the webhook data passed as runbook arguments """
+    payload = " ".join(args)
+    start = payload.find("RequestBody:")
+    if start < 0:
+        raise ValueError("Webhook data has no RequestBody")
+    index = start + len("RequestBody:")
+    while payload[index].isspace():
+        index += 1
+    # Decode the one json value that starts here, leaving the RequestHeader after it untouched
+    body, _ = _DECODER.raw_decode(payload, index)
+    return body
+
+
+class AlertReceiver(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server that collects posted alerts with an AlertBatcher and routes each batch once it closes.
+    Alerts in a batch that repeat one handled within _DEDUPE_WINDOW_SECONDS are dropped
+    """
+    daemon_threads = True
+
+    def __init__(self, address, router, token, batch_seconds=_RECEIVER_BATCH_SECONDS):
+        BaseHTTPServer.HTTPServer.__init__(self, address, AlertRequestHandler)
+        self.router = router
+        self.token = token
+        self.batcher = AlertBatcher(batch_seconds)
+        self.recent_alerts = {}
+        self._alert_added = threading.Event()
+        flusher = threading.Thread(target=self._flush_batches)
+        flusher.daemon = True
+        flusher.start()
+
+    def submit(self, alert):
+        """ Adds an alert to the open batch, returning False if it repeats one already in it """
+        added = self.batcher.add(alert)
+        self._alert_added.set()
+        return added
+
+    def _flush_batches(self):
+        while True:
+            wait = self.batcher.seconds_until_ready()
+            if wait is None:
+                self._alert_added.wait()
+                self._alert_added.clear()
+            elif wait > 0:
+                time.sleep(wait)
+            else:
+                alerts = [alert for alert in self.batcher.flush() if claim_alert(alert, self.recent_alerts)]
+                # Act on the batch in its own thread so slow actions don't hold up the next window
+                if alerts:
+                    threading.Thread(target=self._dispatch, args=(alerts,)).start()
+
+    def _dispatch(self, alerts):
+        try:
+            self.router.dispatch(alerts)
+        except Exception as e:
+            print "Failed to route " + str(len(alerts)) + " alerts: " + str(e)
+        sys.stdout.flush()
+
+
+class AlertRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Accepts an alert posted as json or in the webhook data format, answering 202 if it was queued """
+
+    def do_POST(self):
+        authorization = self.headers.getheader("Authorization", "")
+        if not hmac.compare_digest(authorization, "Bearer " + self.server.token):
+            self.send_error(401)
+            return
+        text = self.rfile.read(int(self.headers.getheader("Content-Length", 0)))
+        try:
+            try:
+                body = json.loads(text)
+            except ValueError:
+                body = parse_request_body([text])
+            alert = Alert(body)
+        except (ValueError, AttributeError, KeyError, TypeError) as e:
+            self.send_error(400, "Could not parse alert: " + str(e))
+            return
+        # 200 tells the sender the alert repeats one already waiting in the batch
+        self.send_response(202 if self.server.submit(alert) else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def serve(port, host=_RECEIVER_HOST):
+    """ Runs the receiver until the process is stopped """
+    token = os.environ.get("ALERT_RECEIVER_TOKEN")
+    if not token:
+        raise ValueError("Set the ALERT_RECEIVER_TOKEN environment variable to the token senders must pass")
+    router = AlertRouter(_ROUTES, _ACTIONS)
+    receiver = AlertReceiver((host, port), router, token)
+    # Authenticate up front so the first alert doesn't wait for it
+    get_credential()
+    print "Listening for alerts on " + host + ":" + str(port)
+    sys.stdout.flush()
+    receiver.serve_forever()
+
+
+def process_webhook(args):
+    """ Handles the alert in the webhook data a job was started with """
+    # Parse the alert sent in the webhook
+    body = parse_request_body(args)
+    alert = Alert(body)
+
+    # Print alerts no route acts on, as sent
+    router = AlertRouter(_ROUTES, _ACTIONS)
+    if router.route(alert) is None:
+        print body
+        return
 
-# Read in all of the input from the webhook parameter
-payload = ""
-for index in range(len(sys.argv)):
-    payload += str(sys.argv[index]).strip()
+    # Act on the alert through the routing table
+    if handle_alerts([alert], router):
+        raise StandardError("Action for the alert failed.")
 
-# Get the RequestBody so we can process it
-start = payload.find("RequestBody:")
-end = payload.find("RequestHeader:")
-requestBody = payload[start+12:end-1]
 
-# Parse body as json string and print out the Python ojbect
-jsonBody = json.loads(str(requestBody))
-print jsonBody
\ No newline at end of file
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["-p"]:
+        # Run as a receiver on the port, and address if passed
+        opts, args = getopt.getopt(sys.argv[1:], "p:b:")
+        options = dict(opts)
+        serve(int(options["-p"]), options.get("-b", _RECEIVER_HOST))
+    else:
+        process_webhook(sys.argv[1:])
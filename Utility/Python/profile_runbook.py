@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""
+Runs any of the Python runbooks with profiling switched on, without changing the runbook.
+
+The runbook runs under cProfile in every thread it starts, every HTTP request it makes
+through requests (which the Azure SDKs use as well) is timed and grouped by the service it
+went to, and on Python 3 allocations are traced with tracemalloc. When the runbook ends, a
+compact summary is written to the job output and the full profile is saved to a file that
+can be opened with python -m pstats or snakeviz.
+
+Set the RUNBOOK_PROFILE environment variable to 0 to run the runbook through this script
+without any profiling, so jobs can keep calling it and profiling can be switched on when needed.
+
+Args:
+    output_dir (-o) - directory to write the profile file to. Default is the temp directory
+    top (-n) - number of functions, requests and allocation sites to list in the summary. Default is 15
+    runbook - path of the runbook to run, followed by its own arguments
+
+    Profile a storage download
+    Example 1:
+            profile_runbook.py -o C:\\profiles download_storage_container.py -p <local_file_path> -r <resource_group> -a <storage_account_name> -c <storage_account_container_name>
+
+Changelog:
+    2026-10-19 AutomationTeam:
+    -initial script
+
+"""
+from __future__ import print_function
+import cProfile
+import collections
+import getopt
+import os
+import pstats
+import runpy
+import sys
+import tempfile
+import threading
+import time
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Host suffixes of the services requests are grouped by
+_SERVICES = (('ARM', 'management.azure.com'), ('AAD', 'login.microsoftonline.com'),
+             ('Blob', '.blob.core.windows.net'), ('PyPI', 'pypi.org'), ('PyPI', 'files.pythonhosted.org'))
+
+
+def get_service(url):
+    """ Returns the name of the service a request url goes to, or its host if it isn't a known one """
+    parts = urlsplit(url)
+    host = parts.netloc.lower().split(':')[0]
+    for name, suffix in _SERVICES:
+        if host == suffix.lstrip('.') or host.endswith(suffix):
+            return name
+    return 'PyPI' if '/simple/' in parts.path else host
+
+
+class HttpSpans(object):
+    """ Times every request sent through requests while installed """
+
+    def __init__(self):
+        # (service, method, url without query, status code, seconds) of each request
+        self.spans = []
+        self._original_send = None
+
+    def install(self):
+        try:
+            import requests.adapters
+        except ImportError:
+            return
+        original_send = self._original_send = requests.adapters.HTTPAdapter.send
+        spans = self.spans
+
+        def send(adapter, request, **kwargs):
+            started = time.time()
+            status = None
+            try:
+                response = original_send(adapter, request, **kwargs)
+                status = response.status_code
+                return response
+            finally:
+                spans.append((get_service(request.url), request.method, request.url.split('?')[0], status,
+                              time.time() - started))
+        requests.adapters.HTTPAdapter.send = send
+
+    def uninstall(self):
+        if self._original_send is not None:
+            import requests.adapters
+            requests.adapters.HTTPAdapter.send = self._original_send
+
+    def summary(self, top):
+        """ Returns lines of totals per service followed by the slowest requests """
+        if not self.spans:
+            return ["No HTTP requests were made"]
+        services = collections.OrderedDict()
+        for service, _, _, _, seconds in self.spans:
+            services.setdefault(service, []).append(seconds)
+        lines = ["HTTP requests by service:"]
+        for service, durations in sorted(services.items(), key=lambda item: -sum(item[1])):
+            durations.sort()
+            lines.append("  %-28s %6d calls %9.2f s total %7.3f s p50 %7.3f s max" % (
+                service, len(durations), sum(durations), durations[len(durations) // 2], durations[-1]))
+        lines.append("Slowest HTTP requests:")
+        for service, method, url, status, seconds in sorted(self.spans, key=lambda span: -span[4])[:top]:
+            lines.append("  %7.3f s  %-6s %s %s" % (seconds, method, status, url))
+        return lines
+
+
+class ThreadProfiler(object):
+    """ Profiles the calling thread and every thread started while enabled, merging them into one set of stats """
+
+    def __init__(self):
+        self.profiles = []
+
+    def _start_thread_profile(self, frame, event, arg):
+        # Called once in each new thread before it runs, replacing itself with a profiler of its own
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        profile.enable()
+
+    def enable(self):
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        # From Python 3.12 a profiler sees every thread and only one can be enabled at a time,
+        # so threads get a profiler of their own only on older versions
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._start_thread_profile)
+        profile.enable()
+
+    def disable(self):
+        self.profiles[0].disable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+
+    def stats(self, stream):
+        stats = pstats.Stats(self.profiles[0], stream=stream)
+        for profile in self.profiles[1:]:
+            profile.create_stats()
+            # Threads that ended before making a call have nothing to merge, and pstats refuses empty profiles
+            if profile.stats:
+                stats.add(profile)
+        return stats
+
+
+def get_peak_rss_mb():
+    """ Returns the peak resident memory of this process in MB where the platform reports it """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def profile_runbook(runbook_path, runbook_args, output_dir, top):
+    """ Runs a runbook as __main__ under the profilers, then prints the summary and saves the profile """
+    sys.argv = [runbook_path] + runbook_args
+    sys.path[0] = os.path.dirname(os.path.abspath(runbook_path))
+    spans = HttpSpans()
+    profiler = ThreadProfiler()
+    spans.install()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    started = time.time()
+    cpu_started = time.clock() if not hasattr(time, 'process_time') else time.process_time()
+    profiler.enable()
+    try:
+        runpy.run_path(runbook_path, run_name='__main__')
+    finally:
+        profiler.disable()
+        wall = time.time() - started
+        cpu = (time.clock() if not hasattr(time, 'process_time') else time.process_time()) - cpu_started
+        spans.uninstall()
+        lines = ["==== Profile of %s ====" % os.path.basename(runbook_path)]
+        memory = "peak memory %s" % ("%.1f MB" % get_peak_rss_mb() if get_peak_rss_mb() is not None else "unknown")
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib.*>")))
+            memory += ", %.1f MB traced" % (tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0))
+            tracemalloc.stop()
+        lines.append("Wall time %.2f s, CPU time %.2f s, %s" % (wall, cpu, memory))
+        lines.extend(spans.summary(top))
+
+        stats_output = StringIO()
+        stats = profiler.stats(stats_output)
+        profile_path = os.path.join(output_dir, "%s-%s.prof" % (
+            os.path.splitext(os.path.basename(runbook_path))[0], time.strftime("%Y%m%d-%H%M%S")))
+        stats.dump_stats(profile_path)
+        stats.sort_stats('cumulative').print_stats(top)
+        lines.append("Top functions by cumulative time:")
+        # Skip the header pstats prints before the table
+        table = stats_output.getvalue().splitlines()
+        header = [index for index, line in enumerate(table) if line.strip().startswith('ncalls')]
+        lines.extend("  " + line for line in table[header[0] if header else 0:] if line.strip())
+
+        if tracemalloc is not None:
+            lines.append("Top allocation sites still holding memory when the runbook ended:")
+            for statistic in snapshot.statistics('lineno')[:top]:
+                frame = statistic.traceback[0]
+                lines.append("  %8.1f KB %7d blocks  %s:%d" % (statistic.size / 1024.0, statistic.count,
+                                                               frame.filename, frame.lineno))
+        lines.append("Full profile written to " + profile_path)
+        print("\n".join(lines))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    # Process any arguments sent in, up to the runbook path
+    output_dir = tempfile.gettempdir()
+    top = 15
+    opts, args = getopt.getopt(sys.argv[1:], "o:n:")
+    for o, a in opts:
+        if o == '-o':
+            output_dir = a
+        elif o == '-n':
+            top = int(a)
+
+    if not args:
+        raise ValueError("Requires the path of the runbook to run, followed by its arguments")
+
+    if os.environ.get("RUNBOOK_PROFILE", "1") == "0":
+        sys.argv = args
+        sys.path[0] = os.path.dirname(os.path.abspath(args[0]))
+        runpy.run_path(args[0], run_name='__main__')
+    else:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        profile_runbook(args[0], args[1:], output_dir, top)
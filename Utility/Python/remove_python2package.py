@@ -3,26 +3,52 @@
 This Azure Automation runbook runs in Azure to remove a package from Azure Automation.
 It requires the subscription id, resource group of the Automation account, Automation name, and package name as arguments.
 Passing in * for the package name will remove all packages from the account.
+A package name containing * or ? is treated as a pattern and every matching package is removed in parallel.
 
 Args:
     subscription_id (-s) - Subscription id of the Automation account
     resource_group (-g) - Resource group name of the Automation account
     automation_account (-a) - Automation account name
-    module_name (-m) - Name of module delete. Use * to remove all packages
+    module_name (-m) - Name of module delete. Use * to remove all packages, or a pattern such as azure-mgmt-*
+    python_version (-p) - Optional python version of the packages to remove, 2 or 3. Defaults to 2
 
     Removes module pytz
     Example:
         remove_python2package.py -s xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxx -g contosogroup -a contosoaccount -m pytz
 
+    Removes all python 3 azure-mgmt packages
+    Example:
+        remove_python2package.py -s xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxx -g contosogroup -a contosoaccount -m azure-mgmt-* -p 3
+
 Changelog:
     2018-10-04 AutomationTeam:
     -initial script
+    2026-10-19 AutomationTeam:
+    -Remove packages matching a pattern in parallel from a single paged listing
+    -Support removing python 3 packages
+    -Revalidate the package listing through arm_read_cache where it is available
 
 """
 import requests
 import sys
 import json
 import getopt
+import fnmatch
+import threading
+import Queue
+try:
+    import arm_read_cache
+except ImportError:
+    arm_read_cache = None
+
+# Max number of packages to remove at a time
+_MAX_THREADS = 10
+
+# Used for the listing. Removal workers mount the same process wide cache on sessions of their own,
+# so a removal still drops the cached listing
+session = requests.Session()
+if arm_read_cache is not None:
+    arm_read_cache.mount(session)
 
 def get_automation_runas_token():
     """ Returs a token that can be used to authenticate against Azure resources """
@@ -56,8 +82,8 @@ def get_automation_runas_token():
 
 def remove_package(packagename):
     # remove package from Azure Automation account
-    request_url = "https://management.azure.com/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Automation/automationAccounts/%s/python2Packages/%s?api-version=2018-06-30" \
-                  % (subscription_id, resource_group, automation_account, packagename)
+    request_url = "https://management.azure.com/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Automation/automationAccounts/%s/%s/%s?api-version=2018-06-30" \
+                  % (subscription_id, resource_group, automation_account, package_type, packagename)
 
     headers = {'Content-Type' : 'application/json', 'Authorization' : "Bearer %s" % token}
     package_info = requests.get(request_url, headers=headers).json()
@@ -71,13 +97,66 @@ def remove_package(packagename):
 
 
 def get_all_packages():
-    # get all automation packages in the account. Returns dictionary of packages
-    request_url = "https://management.azure.com/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Automation/automationAccounts/%s/python2Packages?api-version=2018-06-30" \
-                  % (subscription_id, resource_group, automation_account)
+    # get all automation packages in the account, following nextLink for every page. Returns list of packages
+    request_url = "https://management.azure.com/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Automation/automationAccounts/%s/%s?api-version=2018-06-30" \
+                  % (subscription_id, resource_group, automation_account, package_type)
+
+    # Always revalidate, removing packages from a stale listing could miss ones imported since
+    headers = {'Content-Type' : 'application/json', 'Authorization' : "Bearer %s" % token, 'Cache-Control' : 'no-cache'}
+    packages = []
+    while request_url:
+        response = session.get(request_url, headers=headers)
+        if str(response.status_code) != "200":
+            raise Exception("Error listing packages in Automation account. Error code is {0}".format(str(response.status_code)))
+        package_info = response.json()
+        packages.extend(package_info.get('value', []))
+        request_url = package_info.get('nextLink')
+    return packages
+
+def delete_package(session, packagename):
+    # delete a package that is known to exist from the listing, without checking for it again
+    request_url = "https://management.azure.com/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Automation/automationAccounts/%s/%s/%s?api-version=2018-06-30" \
+                  % (subscription_id, resource_group, automation_account, package_type, packagename)
 
     headers = {'Content-Type' : 'application/json', 'Authorization' : "Bearer %s" % token}
-    package_info = requests.get(request_url, headers=headers).json()
-    return package_info 
+    response_request = session.delete(request_url, headers=headers)
+    if str(response_request.status_code) not in ["200", "201", "204"]:
+        raise Exception("Error removing package {0} from Automation account. Error code is {1}".format(packagename, str(response_request.status_code)))
+
+def remove_packages(packagenames):
+    """ Removes packages in parallel using at most _MAX_THREADS connections. Returns a dictionary of failed packages and errors """
+    package_queue = Queue.Queue()
+    for packagename in packagenames:
+        package_queue.put(packagename)
+    failed = {}
+    lock = threading.Lock()
+
+    def worker():
+        worker_session = requests.Session()
+        if arm_read_cache is not None:
+            arm_read_cache.mount(worker_session)
+        while True:
+            try:
+                packagename = package_queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                delete_package(worker_session, packagename)
+                with lock:
+                    print "Removed {0} from Automation account.".format(packagename)
+                    sys.stdout.flush()
+            except Exception as e:
+                with lock:
+                    failed[packagename] = str(e)
+                    print str(e)
+                    sys.stdout.flush()
+
+    threads = [threading.Thread(target=worker) for _ in range(min(_MAX_THREADS, len(packagenames)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failed
 
 if __name__ == '__main__':
     if len(sys.argv) < 9:
@@ -89,8 +168,9 @@ if __name__ == '__main__':
     resource_group = None
     automation_account = None
     module_name = None
+    package_type = "python2Packages"
 
-    opts, args = getopt.getopt(sys.argv[1:], "s:g:a:m:")
+    opts, args = getopt.getopt(sys.argv[1:], "s:g:a:m:p:")
     for o, i in opts:
         if o == '-s':  
             subscription_id = i
@@ -100,17 +180,26 @@ if __name__ == '__main__':
             automation_account = i
         elif o == '-m': 
             module_name = i
+        elif o == '-p':
+            if i not in ["2", "3"]:
+                raise ValueError("Python version -p must be 2 or 3")
+            package_type = "python%sPackages" % i
 
     # Set Run as token for this automation accounts service principal to be used to import the package into Automation account
     token = get_automation_runas_token()
 
     # Remove packages from Azure Automation
-    if module_name == '*':
-        print "Removing all packages from the automation account..."
+    if '*' in module_name or '?' in module_name:
+        print "Removing all packages matching {0} from the automation account...".format(module_name)
         packages = get_all_packages()
-        for package in packages['value']:
-            remove_package(package['name'])
+        packagenames = [package['name'] for package in packages if fnmatch.fnmatch(package['name'].lower(), module_name.lower())]
+        failed = remove_packages(packagenames)
+        print "\nRemoved {0} of {1} matching packages ({2} packages in the account)".format(len(packagenames) - len(failed), len(packagenames), len(packages))
+        if failed:
+            raise Exception("Error removing packages {0} from Automation account".format(", ".join(sorted(failed))))
     else:
         remove_package(module_name)
 
-    print "\nCompleted removing packages"
\ No newline at end of file
+    print "\nCompleted removing packages"
+    if arm_read_cache is not None:
+        print arm_read_cache.get_shared_cache().summary()
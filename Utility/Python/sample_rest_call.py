@@ -16,9 +16,31 @@ for o, a in opts:
 
 print "Hello " + name
 
+The JobOrchestrator class can also be used to fan out many child jobs from a parent runbook. It keeps
+the number of running jobs within the account limits and tracks all of them from a single polling loop:
+
+    orchestrator = JobOrchestrator(RunAsCredential(runas_connection), subscription_id,
+                                   _AUTOMATION_RESOURCE_GROUP, _AUTOMATION_ACCOUNT)
+    jobs = [("hello_world_python", {"[PARAMETER 1]": "-n", "[PARAMETER 2]": name}) for name in names]
+    for result in orchestrator.run(jobs):
+        print result.job_id, result.status
+        orchestrator.write_job_output(result.job_id)
+
+Changelog:
+    2026-10-19 AutomationTeam:
+    -Add JobOrchestrator to run many child jobs concurrently within the account job limits
+    -Fetch job output stream records concurrently and write them in order as they arrive
+    -Tail job output while the job runs, fetching only records newer than the last poll
+    -Refresh the RunAs token before it expires and retry throttled requests
+
 """
+import sys
 import time
 import uuid
+import threading
+import Queue
+import datetime
+import collections
 import requests
 import automationassets
 
@@ -26,6 +48,33 @@ import automationassets
 _AUTOMATION_RESOURCE_GROUP = "contoso"
 _AUTOMATION_ACCOUNT = "contosodev"
 
+# Automation accepts at most 100 new jobs every 30 seconds per account, and runs at most 200 at a time
+# https://docs.microsoft.com/en-us/azure/azure-subscription-service-limits#automation-limits
+_JOB_SUBMIT_RATE = 100
+_JOB_SUBMIT_PERIOD_SECONDS = 30
+_MAX_CONCURRENT_JOBS = 200
+
+# Running jobs are polled starting at this interval, backing off up to the max interval
+_POLL_INITIAL_SECONDS = 5
+_POLL_MAX_SECONDS = 30
+_POLL_BACKOFF = 1.5
+_TIMEOUT_SECONDS = 3600 # stop waiting for jobs after 60 minutes
+_TERMINAL_STATUSES = ('Completed', 'Failed', 'Suspended', 'Stopped')
+# Jobs created this recently may not be in the job listing yet, so they are checked on their own
+_LISTING_DELAY_SECONDS = 10
+# Acquire a new RunAs token this many seconds before the current one expires
+_TOKEN_REFRESH_SKEW_SECONDS = 300
+# Number of times a throttled (429) request is retried, waiting Retry-After or this many seconds in between
+_MAX_RETRIES = 5
+_RETRY_AFTER_SECONDS = 5
+
+# Max number of stream records fetched at a time, and max number fetched ahead of what has been written
+_MAX_STREAM_THREADS = 8
+_STREAM_WINDOW = 64
+
+# Print the sample job's output while it runs instead of after it finishes
+_TAIL_JOB_OUTPUT = True
+
 # Set up required body values for a runbook.
 # Make sure you have a hello_world_python runbook published in the automation account
 # with an argument of -n
@@ -47,6 +96,10 @@ body = {
 # Return token based on Azure automation Runas connection
 def get_automation_runas_token(runas_connection):
     """ Returs a token that can be used to authenticate against Azure resources """
+    return get_automation_runas_credential(runas_connection).get('accessToken')
+
+def get_automation_runas_credential(runas_connection):
+    """ Returns the token response of the RunAs service principal, with the token and the seconds it is valid for """
     from OpenSSL import crypto
     import adal
 
@@ -70,63 +123,310 @@ def get_automation_runas_token(runas_connection):
         pem_pkey,
         thumbprint)
 
-    # Return the token
-    return azure_credential.get('accessToken')
-
-# Authenticate to Azure using the Azure Automation RunAs service principal
-automation_runas_connection = automationassets.get_automation_connection("AzureRunAsConnection")
-access_token = get_automation_runas_token(automation_runas_connection)
-
-# Set what resources to act against
-subscription_id = str(automation_runas_connection["SubscriptionId"])
-job_id = str(uuid.uuid4())
-
-# Set up URI to create a new automation job
-uri = ("https://management.azure.com/subscriptions/" + subscription_id
-       + "/resourceGroups/" + _AUTOMATION_RESOURCE_GROUP
-       + "/providers/Microsoft.Automation/automationAccounts/" + _AUTOMATION_ACCOUNT
-       + "/jobs/(" + job_id + ")?api-version=2015-10-31")
-
-
-# Make request to create new automation job
-headers = {"Authorization": 'Bearer ' + access_token}
-json_output = requests.put(uri, json=body, headers=headers).json()
-
-# Get results of the automation job
-_RETRY = 360 # stop after 60 minutes (360 * 10 sleep seconds / 60 seconds in a minute)
-_SLEEP_SECONDS = 10
-status_counter = 0
-while status_counter < _RETRY:
-    status_counter = status_counter + 1
-    job = requests.get(uri, headers=headers).json()
-    status = job['properties']['status']
-    if status == 'Completed' or status == 'Failed' or status == 'Suspended' or status == 'Stopped':
-        break
-    time.sleep(_SLEEP_SECONDS)
-
-# if job did not complete in an hour, throw an exception
-if status_counter == 360:
-    raise StandardError("Job did not complete in 60 minutes.")
-
-if job['properties']['status'] != 'Completed':
-    raise StandardError("Job did not complete successfully.")
-
-# Get output streams from the job
-uri = ("https://management.azure.com/subscriptions/" + subscription_id
-       + "/resourceGroups/" + _AUTOMATION_RESOURCE_GROUP
-       + "/providers/Microsoft.Automation/automationAccounts/" + _AUTOMATION_ACCOUNT
-       + "/jobs/" + job_id
-       + "/streams?$filter=properties/streamType%20eq%20'Output'&api-version=2015-10-31")
-
-job_streams = requests.get(uri, headers=headers).json()
-
-# For each stream id, print out the text
-for stream in job_streams['value']:
-    uri = ("https://management.azure.com/subscriptions/" + subscription_id
-           + "/resourceGroups/" + _AUTOMATION_RESOURCE_GROUP
-           + "/providers/Microsoft.Automation/automationAccounts/" + _AUTOMATION_ACCOUNT
-           + "/jobs/" + job_id
-           + "/streams/" + stream['properties']['jobStreamId']
-           + "?$filter=properties/streamType%20eq%20'Output'&api-version=2015-10-31")
-    output_stream = requests.get(uri, headers=headers).json()
-    print output_stream['properties']['streamText']
+    # Return the token response
+    return azure_credential
+
+class RunAsCredential(object):
+    """ Caches the RunAs token and acquires a new one before it expires, so long running jobs can be tracked """
+    def __init__(self, runas_connection):
+        self.runas_connection = runas_connection
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get_token(self, force_refresh=False):
+        """ Returns a valid access token, acquiring a new one on first use, when close to expiry or when forced """
+        with self._lock:
+            if force_refresh or self._token is None or time.time() >= self._expires_at - _TOKEN_REFRESH_SKEW_SECONDS:
+                azure_credential = get_automation_runas_credential(self.runas_connection)
+                self._token = azure_credential['accessToken']
+                self._expires_at = time.time() + float(azure_credential.get('expiresIn', 3600))
+            return self._token
+
+# Result of a child job once it reaches a terminal status
+JobResult = collections.namedtuple('JobResult', ['job_id', 'runbook_name', 'parameters', 'status', 'exception', 'duration'])
+
+class JobOrchestrator(object):
+    """ Starts many runbook jobs and tracks all of them from a single polling loop """
+    def __init__(self, credential, subscription_id, resource_group, automation_account,
+                 max_concurrent_jobs=_MAX_CONCURRENT_JOBS, timeout_seconds=_TIMEOUT_SECONDS):
+        self.account_uri = ("https://management.azure.com/subscriptions/" + subscription_id
+                            + "/resourceGroups/" + resource_group
+                            + "/providers/Microsoft.Automation/automationAccounts/" + automation_account)
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.timeout_seconds = timeout_seconds
+        self.credential = credential
+        self.session = requests.Session()
+        self._submit_times = collections.deque()
+
+    def request(self, method, uri, session=None, **kwargs):
+        """
+        Sends an ARM request with a current token and returns the response. A 401 is retried once with a new token,
+        and a 429 is retried after waiting as long as Retry-After asks. Callers check the final status code
+        """
+        session = session or self.session
+        refreshed = force_refresh = False
+        for attempt in range(_MAX_RETRIES + 1):
+            headers = {"Authorization": 'Bearer ' + self.credential.get_token(force_refresh)}
+            force_refresh = False
+            response = session.request(method, uri, headers=headers, **kwargs)
+            if response.status_code == 401 and not refreshed:
+                refreshed = force_refresh = True
+            elif response.status_code == 429 and attempt < _MAX_RETRIES:
+                time.sleep(float(response.headers.get('Retry-After', _RETRY_AFTER_SECONDS)))
+            else:
+                break
+        return response
+
+    def start_job(self, runbook_name, parameters):
+        """ Creates a new job for a runbook and returns its job id """
+        # Wait until the account accepts another job within its submission rate
+        while len(self._submit_times) >= _JOB_SUBMIT_RATE:
+            wait = self._submit_times[0] + _JOB_SUBMIT_PERIOD_SECONDS - time.time()
+            if wait <= 0:
+                self._submit_times.popleft()
+            else:
+                time.sleep(wait)
+        job_id = str(uuid.uuid4())
+        uri = self.account_uri + "/jobs/(" + job_id + ")?api-version=2015-10-31"
+        job_body = {"properties": {"runbook": {"name": runbook_name}, "parameters": parameters or {}}}
+        response = self.request("PUT", uri, json=job_body)
+        self._submit_times.append(time.time())
+        if response.status_code not in (200, 201):
+            raise StandardError("Error starting runbook {0}. Error code is {1}".format(runbook_name, response.status_code))
+        return job_id
+
+    def get_job_statuses(self, since):
+        """ Returns a dictionary of job id to status for all jobs created in the account since a UTC time """
+        uri = (self.account_uri + "/jobs?$filter=properties/creationTime%20ge%20"
+               + since.strftime("%Y-%m-%dT%H:%M:%SZ") + "&api-version=2015-10-31")
+        statuses = {}
+        while uri:
+            response = self.request("GET", uri)
+            if response.status_code != 200:
+                raise StandardError("Error listing jobs. Error code is {0}".format(response.status_code))
+            page = response.json()
+            for job in page.get('value', []):
+                statuses[job['properties']['jobId']] = job['properties']['status']
+            uri = page.get('nextLink')
+        return statuses
+
+    def get_job_status(self, job_id):
+        """ Returns the status of a single job """
+        uri = self.account_uri + "/jobs/(" + job_id + ")?api-version=2015-10-31"
+        response = self.request("GET", uri)
+        if response.status_code != 200:
+            raise StandardError("Error reading job {0}. Error code is {1}".format(job_id, response.status_code))
+        return response.json()['properties']['status']
+
+    def iter_job_streams(self, job_id, stream_type='Output', since=None):
+        """
+        Yields the stream summaries of a job page by page, following nextLink only as far as they are consumed.
+        Pass None as stream_type for all streams, and a record time as since for only the records from then on
+        """
+        filters = []
+        if stream_type is not None:
+            filters.append("properties/streamType eq '" + stream_type + "'")
+        if since is not None:
+            filters.append("properties/time ge " + since)
+        uri = self.account_uri + "/jobs/" + job_id + "/streams?api-version=2015-10-31"
+        if filters:
+            uri += "&$filter=" + requests.utils.quote(" and ".join(filters), safe="/'")
+        while uri:
+            response = self.request("GET", uri)
+            if response.status_code != 200:
+                raise StandardError("Error listing streams of job {0}. Error code is {1}".format(job_id, response.status_code))
+            page = response.json()
+            for stream in page.get('value', []):
+                yield stream
+            uri = page.get('nextLink')
+
+    def get_stream_text(self, session, job_id, job_stream_id):
+        """ Returns the full text of a single job stream record """
+        uri = (self.account_uri + "/jobs/" + job_id + "/streams/" + job_stream_id + "?api-version=2015-10-31")
+        response = self.request("GET", uri, session=session)
+        if response.status_code != 200:
+            raise StandardError("Error reading stream {0} of job {1}. Error code is {2}".format(
+                job_stream_id, job_id, response.status_code))
+        return response.json()['properties']['streamText']
+
+    def write_job_output(self, job_id, out=None, stream_type='Output'):
+        """ Writes all stream records of a job to out (stdout by default), returning the number written """
+        return self.write_streams(job_id, self.iter_job_streams(job_id, stream_type), out)
+
+    def write_streams(self, job_id, streams, out=None):
+        """
+        Writes the full text of stream summaries to out (stdout by default). Records are fetched by _MAX_STREAM_THREADS
+        threads but written in their original order as soon as each one and all before it have arrived
+        """
+        out = out or sys.stdout
+        work = Queue.Queue()
+        window = threading.BoundedSemaphore(_STREAM_WINDOW)
+        results = {}
+        total = []
+        arrived = threading.Condition()
+        stopped = threading.Event()
+
+        def list_streams():
+            count = 0
+            try:
+                for stream in streams:
+                    # Don't run further ahead of the writer than the window allows
+                    window.acquire()
+                    if stopped.is_set():
+                        break
+                    work.put((count, stream['properties']['jobStreamId']))
+                    count += 1
+            except Exception as e:
+                with arrived:
+                    results[count] = e
+                    count += 1
+            finally:
+                for _ in fetchers:
+                    work.put(None)
+                with arrived:
+                    total.append(count)
+                    arrived.notify_all()
+
+        def fetch_streams():
+            session = requests.Session()
+            while True:
+                item = work.get()
+                if item is None or stopped.is_set():
+                    return
+                index, job_stream_id = item
+                try:
+                    text = self.get_stream_text(session, job_id, job_stream_id)
+                except Exception as e:
+                    text = e
+                with arrived:
+                    results[index] = text
+                    arrived.notify_all()
+
+        fetchers = [threading.Thread(target=fetch_streams) for _ in range(_MAX_STREAM_THREADS)]
+        threads = fetchers + [threading.Thread(target=list_streams)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        next_index = 0
+        while True:
+            with arrived:
+                while next_index not in results and not (total and next_index >= total[0]):
+                    arrived.wait(1)
+                if next_index not in results:
+                    break
+                text = results.pop(next_index)
+            if isinstance(text, Exception):
+                # Stop listing and fetching records that will never be written before giving up
+                stopped.set()
+                for _ in fetchers:
+                    work.put(None)
+                try:
+                    window.release()
+                except ValueError:
+                    pass
+                for fetcher in fetchers:
+                    fetcher.join()
+                raise text
+            out.write("%s\n" % text)
+            out.flush()
+            window.release()
+            next_index += 1
+        return next_index
+
+    def tail_job_output(self, job_id, out=None, stream_type='Output'):
+        """
+        Writes stream records of a job to out (stdout by default) while it runs and returns its final status.
+        Each poll only lists records from the time of the newest one already written, skipping those already seen
+        """
+        cursor = None
+        seen_at_cursor = set()
+        delay = _POLL_INITIAL_SECONDS
+        while True:
+            # Read the status before the streams so nothing written before the job finished is missed
+            status = self.get_job_status(job_id)
+            new_streams = [stream for stream in self.iter_job_streams(job_id, stream_type, since=cursor)
+                           if stream['properties']['jobStreamId'] not in seen_at_cursor]
+            if new_streams:
+                self.write_streams(job_id, new_streams, out)
+                newest = new_streams[-1]['properties']['time']
+                if newest != cursor:
+                    cursor = newest
+                    seen_at_cursor = set()
+                seen_at_cursor.update(stream['properties']['jobStreamId'] for stream in new_streams
+                                      if stream['properties']['time'] == cursor)
+                delay = _POLL_INITIAL_SECONDS
+            else:
+                delay = min(delay * _POLL_BACKOFF, _POLL_MAX_SECONDS)
+            if status in _TERMINAL_STATUSES:
+                return status
+            time.sleep(delay)
+
+    def run(self, jobs):
+        """
+        Starts a job for every (runbook name, parameters) pair, keeping at most max_concurrent_jobs running,
+        and yields a JobResult for each job as soon as it reaches a terminal status
+        """
+        pending = collections.deque(jobs)
+        running = {}
+        # Only list jobs created since shortly before the first one, allowing for clock skew
+        since = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+        started = time.time()
+        delay = _POLL_INITIAL_SECONDS
+        while pending or running:
+            while pending and len(running) < self.max_concurrent_jobs:
+                runbook_name, parameters = pending.popleft()
+                try:
+                    job_id = self.start_job(runbook_name, parameters)
+                except StandardError as e:
+                    yield JobResult(None, runbook_name, parameters, 'Failed', e, 0)
+                    continue
+                running[job_id] = (runbook_name, parameters, time.time())
+            if not running:
+                continue
+            time.sleep(delay)
+            # One listing of the account covers every running job
+            statuses = self.get_job_statuses(since)
+            settled = False
+            for job_id, (runbook_name, parameters, submitted_at) in running.items():
+                status = statuses.get(job_id)
+                if status is None and time.time() - submitted_at < _LISTING_DELAY_SECONDS:
+                    status = self.get_job_status(job_id)
+                if status in _TERMINAL_STATUSES:
+                    del running[job_id]
+                    settled = True
+                    exception = None if status == 'Completed' else StandardError("Job did not complete successfully.")
+                    yield JobResult(job_id, runbook_name, parameters, status, exception, time.time() - submitted_at)
+            if time.time() - started > self.timeout_seconds:
+                for job_id, (runbook_name, parameters, submitted_at) in running.items():
+                    yield JobResult(job_id, runbook_name, parameters, statuses.get(job_id),
+                                    StandardError("Job did not complete in %d minutes." % (self.timeout_seconds / 60)),
+                                    time.time() - submitted_at)
+                running.clear()
+                pending.clear()
+            # Poll quickly again while jobs are finishing and slots are being refilled, back off otherwise
+            delay = _POLL_INITIAL_SECONDS if settled and pending else min(delay * _POLL_BACKOFF, _POLL_MAX_SECONDS)
+
+if __name__ == '__main__':
+    # Authenticate to Azure using the Azure Automation RunAs service principal
+    automation_runas_connection = automationassets.get_automation_connection("AzureRunAsConnection")
+    credential = RunAsCredential(automation_runas_connection)
+
+    # Set what resources to act against
+    subscription_id = str(automation_runas_connection["SubscriptionId"])
+
+    orchestrator = JobOrchestrator(credential, subscription_id, _AUTOMATION_RESOURCE_GROUP, _AUTOMATION_ACCOUNT)
+    if _TAIL_JOB_OUTPUT:
+        # Start the automation job and print its output while it runs
+        job_id = orchestrator.start_job(body["properties"]["runbook"]["name"], body["properties"]["parameters"])
+        if orchestrator.tail_job_output(job_id) != 'Completed':
+            raise StandardError("Job did not complete successfully.")
+    else:
+        # Start the automation job and wait for it to finish
+        for result in orchestrator.run([(body["properties"]["runbook"]["name"], body["properties"]["parameters"])]):
+            job_id = result.job_id
+            if result.exception is not None:
+                raise result.exception
+
+        # Print the output of the job as it is retrieved
+        orchestrator.write_job_output(job_id)
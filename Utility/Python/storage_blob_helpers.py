@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+Blob storage helpers shared by the runbooks that download containers from a storage account.
+
+StorageCredentialProvider hands out blob services authenticated with container SAS tokens that
+later jobs reuse, and extract_blob extracts .zip, .tar, .tar.gz, .tgz and .gz blobs while they
+download, checking each range and member as it arrives.
+
+    import storage_blob_helpers
+
+    credentials = storage_blob_helpers.StorageCredentialProvider(get_storage_client, runas_connection)
+    service = credentials.get_blob_service(resource_group, account_name, container_name)
+    for blob in service.list_blobs(container_name):
+        if blob.name.lower().endswith(storage_blob_helpers.ARCHIVE_EXTENSIONS):
+            storage_blob_helpers.extract_blob(service, container_name, blob, local_path)
+
+Publish this file as a runbook and load it with import_child_runbook.ChildRunbookImporter, or
+copy it next to the runbooks on a Hybrid Worker. Runbooks that import it work without it as well,
+authenticating with the account key on every run and without extracting archives.
+
+Changelog:
+    2026-10-19 AutomationTeam:
+    -initial script
+
+"""
+import base64
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from azure.storage.blob import BlockBlobService
+
+# Blobs extract_blob can extract
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.gz')
+# Bytes downloaded per request when reading an archive. Content MD5 can be validated for ranges up to 4 MB
+RANGE_BYTES = 4 * 1024 * 1024
+# Directory only this user can read, holding the SAS tokens later jobs reuse
+SAS_CACHE_DIR = os.path.join(tempfile.gettempdir(), "automation_sas_cache")
+# Lifetime of a new SAS token, and the time left below which a cached one is replaced
+SAS_LIFETIME_SECONDS = 4 * 60 * 60
+SAS_RENEW_SECONDS = 60 * 60
+# Directory only this user can read, holding the Content-MD5 of every archive extracted,
+# so they stay out of the directories the archives are extracted into
+MARKER_DIR = os.path.join(tempfile.gettempdir(), "extracted_blob_markers")
+
+
+def get_private_dir(path):
+    """ Returns a directory only this user can use, creating it if needed and checking no one else owns it """
+    try:
+        os.mkdir(path, 0o700)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    if hasattr(os, "getuid"):
+        if os.stat(path).st_uid != os.getuid():
+            raise OSError("Directory " + path + " is owned by another user")
+        os.chmod(path, 0o700)
+    return path
+
+
+def _hash_name(name):
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+
+class StorageCredentialProvider(object):
+    """
+    Hands out blob services authenticated with SAS tokens scoped to a container. Tokens are saved for later
+    jobs running as the same RunAs application in the same subscription, and reused until they are close
+    to expiry, so account keys are only listed when a token is signed
+    """
+    def __init__(self, get_storage_client, runas_connection):
+        self.get_storage_client = get_storage_client
+        self.identity = "%s/%s" % (runas_connection["SubscriptionId"], runas_connection["ApplicationId"])
+        self._storage_client = None
+        # (resource group, account name) -> account key, only ever kept in memory
+        self._account_keys = {}
+
+    def get_account_key(self, resource_group, account_name):
+        if (resource_group, account_name) not in self._account_keys:
+            if self._storage_client is None:
+                self._storage_client = self.get_storage_client()
+            storage_keys = self._storage_client.storage_accounts.list_keys(resource_group, account_name)
+            self._account_keys[(resource_group, account_name)] = storage_keys.keys[0].value
+        return self._account_keys[(resource_group, account_name)]
+
+    def get_container_sas(self, resource_group, account_name, container_name, permission="rl", renew=False):
+        """ Returns a SAS token for a container, signing a new one if renew is set or the saved one expires soon """
+        sas_path = os.path.join(get_private_dir(SAS_CACHE_DIR), _hash_name(
+            "%s/%s/%s/%s" % (self.identity, account_name, container_name, permission)) + ".json")
+        if renew:
+            # The key the saved token was signed with may have been rotated
+            self._account_keys.pop((resource_group, account_name), None)
+        else:
+            try:
+                with open(sas_path) as sas_file:
+                    saved = json.load(sas_file)
+                if saved["expiry"] - time.time() > SAS_RENEW_SECONDS:
+                    return saved["token"]
+            except (IOError, ValueError, KeyError):
+                pass
+
+        expiry = time.time() + SAS_LIFETIME_SECONDS
+        key_service = BlockBlobService(account_name=account_name,
+                                       account_key=self.get_account_key(resource_group, account_name))
+        # Start a few minutes back so clock skew with the storage service doesn't reject a new token
+        token = key_service.generate_container_shared_access_signature(
+            container_name, permission=permission, protocol="https",
+            start=datetime.datetime.utcnow() - datetime.timedelta(minutes=5),
+            expiry=datetime.datetime.utcfromtimestamp(expiry))
+
+        # Write to a file only this user can read, then move it into place so no job sees it half written
+        temp_fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(sas_path))
+        with os.fdopen(temp_fd, 'w') as sas_file:
+            json.dump({"token": token, "expiry": expiry}, sas_file)
+        try:
+            if os.path.exists(sas_path):
+                os.remove(sas_path)
+            os.rename(temp_path, sas_path)
+        except OSError:
+            os.remove(temp_path)
+        return token
+
+    def get_blob_service(self, resource_group, account_name, container_name, permission="rl", renew=False):
+        """ Returns a blob service that can use a container with the given SAS permissions, such as rl or rwl """
+        return BlockBlobService(account_name=account_name, sas_token=self.get_container_sas(
+            resource_group, account_name, container_name, permission, renew))
+
+
+class BlobReader(object):
+    """ Read-only, seekable file over a blob that downloads it in validated ranges as it is read """
+    def __init__(self, service, container_name, blob_name, size):
+        self.service = service
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.size = size
+        self.position = 0
+        self._buffer = b""
+        self._buffer_start = 0
+        # MD5 of the blob as far as it has been read in order from the start
+        self._md5 = hashlib.md5()
+        self._hashed = 0
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        chunks = []
+        while size > 0:
+            offset = self.position - self._buffer_start
+            if not 0 <= offset < len(self._buffer):
+                end = min(self.size, self.position + RANGE_BYTES) - 1
+                self._buffer = self.service.get_blob_to_bytes(
+                    self.container_name, self.blob_name, start_range=self.position, end_range=end,
+                    validate_content=True).content
+                self._buffer_start = self.position
+                if self._buffer_start == self._hashed:
+                    self._md5.update(self._buffer)
+                    self._hashed += len(self._buffer)
+                offset = 0
+            chunk = self._buffer[offset:offset + size]
+            chunks.append(chunk)
+            self.position += len(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def verify(self, content_md5):
+        """ Raises an error if the whole blob was read in order and doesn't match its content MD5 """
+        if content_md5 and self._hashed == self.size and base64.b64encode(self._md5.digest()).decode() != content_md5:
+            raise IOError("Content of " + self.blob_name + " does not match its MD5")
+
+
+def check_member_path(member_name):
+    """ Raises an error for archive members that would be extracted outside the target directory """
+    parts = member_name.replace('\\', '/').split('/')
+    if member_name.startswith(('/', '\\')) or '..' in parts or ':' in parts[0]:
+        raise ValueError("Archive member " + member_name + " would be extracted outside the target directory")
+
+
+def extract_blob(service, container_name, blob_file, local_path):
+    """ extracts an archive from storage into the local directory it is in while it downloads """
+    directoryname, filename = os.path.split(blob_file.name)
+    target_path = os.path.join(local_path, directoryname)
+    if not os.path.exists(target_path):
+        os.makedirs(target_path)
+    # Skip the archive if this version of it was already extracted into this directory
+    content_md5 = blob_file.properties.content_settings.content_md5
+    marker_path = os.path.join(get_private_dir(MARKER_DIR), _hash_name("%s/%s/%s|%s" % (
+        service.account_name, container_name, blob_file.name, os.path.abspath(target_path))))
+    if content_md5 and os.path.exists(marker_path):
+        with open(marker_path) as marker:
+            if marker.read() == content_md5:
+                return
+
+    reader = BlobReader(service, container_name, blob_file.name, blob_file.properties.content_length)
+    if filename.lower().endswith('.zip'):
+        # Only the central directory and the members are downloaded; each member's CRC is checked as it is read
+        archive = zipfile.ZipFile(reader)
+        for member in archive.infolist():
+            check_member_path(member.filename)
+        archive.extractall(target_path)
+        archive.close()
+    elif filename.lower().endswith(('.tar', '.tar.gz', '.tgz')):
+        archive = tarfile.open(fileobj=reader, mode='r|*')
+        for member in archive:
+            check_member_path(member.name)
+            if member.issym() or member.islnk():
+                check_member_path(os.path.join(os.path.dirname(member.name), member.linkname))
+            archive.extract(member, target_path)
+        archive.close()
+        # Read the end-of-archive padding too, so the whole blob is checked against its MD5
+        while reader.read(RANGE_BYTES):
+            pass
+    else:
+        # gzip checks the CRC and length of the content when it reaches the end
+        extracted_path = os.path.join(target_path, filename[:-3])
+        try:
+            with open(extracted_path, 'wb') as extracted_file:
+                shutil.copyfileobj(gzip.GzipFile(filename, 'rb', fileobj=reader), extracted_file, RANGE_BYTES)
+        except Exception:
+            os.remove(extracted_path)
+            raise
+    reader.verify(content_md5)
+    if content_md5:
+        with open(marker_path, 'w') as marker:
+            marker.write(content_md5)